@@ -0,0 +1,159 @@
+import os
+import sqlite3
+
+import pandas as pd
+
+from dataset import DATE_COLUMN, dataset_columns, read_partition
+from manifest import dataset_hash
+
+PERIODS = ['day', 'week']
+
+# Above / below these values an article counts as positive / negative. Every measure is on [-1, 1]
+POSITIVE_THRESHOLD = 0.05
+NEGATIVE_THRESHOLD = -0.05
+
+FINBERT_POLARITY = {'Positive': 1.0, 'Neutral': 0.0, 'Negative': -1.0}
+
+# One measure per model, over the columns each model scores the whole article with (FinBERT only scores the title and subtitle)
+MEASURE_COLUMNS = {'pysentimiento': ['news_joined_prob_POS_pysent', 'news_joined_prob_NEG_pysent'],
+                   'sentiment_spanish': ['news_joined_sent_sentspanish'],
+                   'vader': ['news_text_content_english_polarity_COM_nltk'],
+                   'textblob': ['news_text_content_english_pol_textblob'],
+                   'finbert': ['news_title_english_label_finbert']}
+
+def measure_values(dataframe, measure):
+  if measure == 'pysentimiento':
+    return dataframe['news_joined_prob_POS_pysent'] - dataframe['news_joined_prob_NEG_pysent']
+  if measure == 'sentiment_spanish':
+    # sentiment-spanish scores the probability of the article being positive
+    return 2 * dataframe['news_joined_sent_sentspanish'] - 1
+  if measure == 'finbert':
+    return dataframe['news_title_english_label_finbert'].astype(str).map(FINBERT_POLARITY)
+  return dataframe[MEASURE_COLUMNS[measure][0]]
+
+def period_starts(dates, period):
+  if period == 'day':
+    return dates.dt.strftime('%Y-%m-%d')
+  # Weeks start on Monday
+  return (dates - pd.to_timedelta(dates.dt.weekday, unit = 'D')).dt.strftime('%Y-%m-%d')
+
+def partial_aggregates(dataframe, measures = None, date_column = DATE_COLUMN):
+  measures = [measure for measure in (measures or MEASURE_COLUMNS) if set(MEASURE_COLUMNS[measure]) <= set(dataframe.columns)]
+
+  # The news without a (valid) date, in month 00 of the dataset, have no day or week; without a date column none has
+  if date_column in dataframe.columns:
+    dates = pd.to_datetime(dataframe[date_column], errors = 'coerce')
+  else:
+    dates = pd.Series(pd.NaT, index = dataframe.index, dtype = 'datetime64[ns]')
+  dataframe = dataframe[dates.notna()]
+  dates = dates[dates.notna()]
+
+  partials = []
+  for measure in measures:
+    values = pd.to_numeric(measure_values(dataframe, measure), errors = 'coerce')
+    for period in PERIODS:
+      scored = pd.DataFrame({'search_term': dataframe['search_term'].astype(str), 'period_start': period_starts(dates, period), 'value': values})
+      scored = scored.dropna()
+      scored['positive'] = scored['value'] > POSITIVE_THRESHOLD
+      scored['negative'] = scored['value'] < NEGATIVE_THRESHOLD
+
+      grouped = scored.groupby(['search_term', 'period_start']).agg(count = ('value', 'size'), total = ('value', 'sum'),
+                                                                    positives = ('positive', 'sum'), negatives = ('negative', 'sum')).reset_index()
+      grouped.insert(1, 'period', period)
+      grouped.insert(3, 'measure', measure)
+      partials.append(grouped)
+
+  if not partials:
+    return pd.DataFrame(columns = ['search_term', 'period', 'period_start', 'measure', 'count', 'total', 'positives', 'negatives'])
+  return pd.concat(partials, ignore_index = True)
+
+# Rolling per search term, per day and per week aggregates of the scores of every model. Every partition (year) of the
+# sentiment dataset keeps its own partial sums, so a new or scored again partition only recomputes the windows it touches
+# (a week can span two years)
+class SentimentAggregates:
+
+  def __init__(self, filename = 'sentiment_aggregates.sqlite', date_column = DATE_COLUMN):
+    self.filename = filename
+    self.date_column = date_column
+    self.connection = sqlite3.connect(filename, timeout = 60)
+    self.connection.executescript('''
+      CREATE TABLE IF NOT EXISTS partitions (partition TEXT PRIMARY KEY, dataset_hash TEXT NOT NULL);
+      CREATE TABLE IF NOT EXISTS partials (partition TEXT NOT NULL, search_term TEXT NOT NULL, period TEXT NOT NULL, period_start TEXT NOT NULL,
+                                           measure TEXT NOT NULL, count INTEGER NOT NULL, total REAL NOT NULL, positives INTEGER NOT NULL,
+                                           negatives INTEGER NOT NULL, PRIMARY KEY (partition, search_term, period, period_start, measure));
+      CREATE TABLE IF NOT EXISTS aggregates (search_term TEXT NOT NULL, period TEXT NOT NULL, period_start TEXT NOT NULL, measure TEXT NOT NULL,
+                                             count INTEGER NOT NULL, mean REAL NOT NULL, positive_share REAL NOT NULL, negative_share REAL NOT NULL,
+                                             PRIMARY KEY (search_term, period, period_start, measure));
+      CREATE INDEX IF NOT EXISTS partials_window ON partials (search_term, period, period_start);
+    ''')
+
+  def close(self):
+    self.connection.close()
+
+  def update(self, dataset_dir, year):
+    current_hash = dataset_hash(dataset_dir, year)
+
+    stored = self.connection.execute('SELECT dataset_hash FROM partitions WHERE partition = ?', (str(year),)).fetchone()
+    if stored is not None and stored[0] == current_hash:
+      return False
+
+    available_columns = set(dataset_columns(dataset_dir))
+    columns = [column for column in ['search_term', self.date_column] + sum(MEASURE_COLUMNS.values(), []) if column in available_columns]
+    partials = partial_aggregates(read_partition(dataset_dir, year, columns = columns), date_column = self.date_column)
+    self._replace_partials(str(year), partials, current_hash)
+    return True
+
+  def update_all(self, dataset_dir = 'news_sentiment'):
+    years = sorted(year_dir[5:] for year_dir in os.listdir(dataset_dir) if year_dir.startswith('year=')) if os.path.exists(dataset_dir) else []
+    updated = [year for year in years if self.update(dataset_dir, year)]
+
+    # Years no longer in the dataset leave the aggregates too
+    for year, in self.connection.execute('SELECT partition FROM partitions').fetchall():
+      if year not in years:
+        self.remove(year)
+        updated.append(year)
+
+    return updated
+
+  def remove(self, year):
+    self._replace_partials(str(year), partial_aggregates(pd.DataFrame(columns = ['search_term'])), None)
+
+  def frame(self, period = 'day', search_term = None, measure = None):
+    query = 'SELECT search_term, period_start, measure, count, mean, positive_share, negative_share FROM aggregates WHERE period = ?'
+    parameters = [period]
+    if search_term is not None:
+      query += ' AND search_term = ?'
+      parameters.append(search_term)
+    if measure is not None:
+      query += ' AND measure = ?'
+      parameters.append(measure)
+
+    return pd.read_sql_query(query + ' ORDER BY search_term, measure, period_start', self.connection, params = parameters)
+
+  def _replace_partials(self, partition, partials, current_hash):
+    with self.connection:
+      # The windows the partition contributed to before and after the change are the only ones recomputed
+      self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS affected (search_term TEXT, period TEXT, period_start TEXT)')
+      self.connection.execute('DELETE FROM affected')
+      self.connection.execute('INSERT INTO affected SELECT DISTINCT search_term, period, period_start FROM partials WHERE partition = ?', (partition,))
+      self.connection.executemany('INSERT INTO affected VALUES (?, ?, ?)',
+                                  partials[['search_term', 'period', 'period_start']].drop_duplicates().itertuples(index = False, name = None))
+
+      self.connection.execute('DELETE FROM partials WHERE partition = ?', (partition,))
+      self.connection.executemany('INSERT INTO partials VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                  ((partition, search_term, period, period_start, measure, int(count), float(total), int(positives), int(negatives))
+                                   for search_term, period, period_start, measure, count, total, positives, negatives
+                                   in partials.itertuples(index = False, name = None)))
+
+      self.connection.execute('''DELETE FROM aggregates WHERE (search_term, period, period_start) IN (SELECT search_term, period, period_start FROM affected)''')
+      self.connection.execute('''INSERT INTO aggregates
+                                 SELECT search_term, period, period_start, measure, SUM(count), SUM(total) / SUM(count),
+                                        1.0 * SUM(positives) / SUM(count), 1.0 * SUM(negatives) / SUM(count)
+                                 FROM partials
+                                 WHERE (search_term, period, period_start) IN (SELECT search_term, period, period_start FROM affected)
+                                 GROUP BY search_term, period, period_start, measure''')
+
+      if current_hash is None:
+        self.connection.execute('DELETE FROM partitions WHERE partition = ?', (partition,))
+      else:
+        self.connection.execute('INSERT OR REPLACE INTO partitions (partition, dataset_hash) VALUES (?, ?)', (partition, current_hash))
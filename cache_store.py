@@ -0,0 +1,123 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+SQLITE_MAX_PARAMS = 900
+
+class SqliteCache:
+
+  def __init__(self, filename, table = 'cache', memory_items = 10000, max_bytes = None):
+    self.filename = filename
+    self.table = table
+    self.memory_items = memory_items
+    self.max_bytes = max_bytes
+    self.memory = OrderedDict()
+    self.connection = None
+    self.lock = threading.RLock()
+
+  def __getstate__(self):
+    # sqlite connections can not be shared between processes: every worker reopens its own
+    state = self.__dict__.copy()
+    state['memory'] = OrderedDict()
+    state['connection'] = None
+    del state['lock']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.lock = threading.RLock()
+
+  def connect(self):
+    if self.connection is None:
+      # Threads in the same process share the connection; the lock serializes its use
+      self.connection = sqlite3.connect(self.filename, timeout = 60, check_same_thread = False)
+      self.connection.execute(f'''CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT NOT NULL,
+                                                                           size INTEGER NOT NULL DEFAULT 0,
+                                                                           accessed REAL NOT NULL DEFAULT 0)''')
+      self.connection.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table} (accessed)')
+    return self.connection
+
+  def close(self):
+    with self.lock:
+      if self.connection is not None:
+        self.connection.close()
+        self.connection = None
+
+  def get(self, key, default = None):
+    return self.get_many([key]).get(key, default)
+
+  def put(self, key, value):
+    self.put_many({key: value})
+
+  def get_many(self, keys):
+    with self.lock:
+      return self._get_many(keys)
+
+  def put_many(self, items):
+    with self.lock:
+      self._put_many(items)
+
+  def _get_many(self, keys):
+    found = {}
+    missing = []
+
+    for key in dict.fromkeys(keys):
+      if key in self.memory:
+        self.memory.move_to_end(key)
+        found[key] = self.memory[key]
+      else:
+        missing.append(key)
+
+    connection = self.connect()
+    for start in range(0, len(missing), SQLITE_MAX_PARAMS):
+      keys_chunk = missing[start: start + SQLITE_MAX_PARAMS]
+      placeholders = ','.join('?' * len(keys_chunk))
+      for key, value in connection.execute(f'SELECT key, value FROM {self.table} WHERE key IN ({placeholders})', keys_chunk):
+        found[key] = value
+        self._remember(key, value)
+
+    # Access times only matter to the size based eviction
+    if self.max_bytes is not None and found:
+      accessed = time.time()
+      with connection:
+        connection.executemany(f'UPDATE {self.table} SET accessed = ? WHERE key = ?', ((accessed, key) for key in found))
+
+    return found
+
+  def _put_many(self, items):
+    items = dict(items)
+    if not items:
+      return
+
+    accessed = time.time()
+    with self.connect() as connection:
+      connection.executemany(f'INSERT OR REPLACE INTO {self.table} (key, value, size, accessed) VALUES (?, ?, ?, ?)',
+                             ((key, value, len(key) + len(value), accessed) for key, value in items.items()))
+      if self.max_bytes is not None:
+        self._evict(connection)
+
+    for key, value in items.items():
+      self._remember(key, value)
+
+  def _evict(self, connection):
+    total_bytes, = connection.execute(f'SELECT COALESCE(SUM(size), 0) FROM {self.table}').fetchone()
+    if total_bytes <= self.max_bytes:
+      return
+
+    evicted = []
+    for key, size in connection.execute(f'SELECT key, size FROM {self.table} ORDER BY accessed'):
+      if total_bytes <= self.max_bytes:
+        break
+      evicted.append((key,))
+      total_bytes -= size
+
+    connection.executemany(f'DELETE FROM {self.table} WHERE key = ?', evicted)
+    for key, in evicted:
+      self.memory.pop(key, None)
+
+  def _remember(self, key, value):
+    self.memory[key] = value
+    self.memory.move_to_end(key)
+    while len(self.memory) > self.memory_items:
+      self.memory.popitem(last = False)
@@ -0,0 +1,180 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import pandas as pd
+
+from manifest import Manifest, terms_key
+from near_duplicates import NearDuplicateIndex
+from normalization import file_hash
+
+def month_partitions(start_date, end_date):
+  year, month = map(int, start_date.split('-'))
+  end_year, end_month = map(int, end_date.split('-'))
+
+  partitions = []
+  while (year, month) <= (end_year, end_month):
+    partitions.append(f'{year}-{month:02d}')
+    year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+  return partitions
+
+def project_item_pipelines(project_dir = 'portafolio_news_scraper'):
+  # Read by scrapy itself from the project directory, so it sees the same settings as the crawl
+  code = 'import json; from scrapy.utils.project import get_project_settings; print(json.dumps(get_project_settings().getdict("ITEM_PIPELINES")))'
+  completed = subprocess.run([sys.executable, '-c', code], cwd = project_dir, capture_output = True, text = True, check = True)
+  return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def crawl_partition(search_terms, partition, months_dir, project_dir = 'portafolio_news_scraper', spider = 'news', clean_items = False,
+                    item_pipelines = None):
+  output_path = f'{months_dir}/news-{partition}.csv'
+
+  # scrapy picks the feed format from the extension, so the partial file keeps .csv at the end
+  partial_path = f'{months_dir}/news-{partition}.partial.csv'
+  if os.path.exists(partial_path):
+    os.remove(partial_path)
+
+  command = [sys.executable, '-m', 'scrapy', 'crawl', spider, '-a', f'search_terms={",".join(search_terms)}',
+             '-a', f'start_date={partition}', '-a', f'end_date={partition}', '-o', os.path.relpath(partial_path, project_dir)]
+
+  # The items are cleaned as they are crawled (scrapy_pipelines.CleanNewsPipeline, from this directory) after the
+  # pipelines of the project, which -s ITEM_PIPELINES would otherwise replace
+  environment = None
+  if clean_items:
+    item_pipelines = dict(project_item_pipelines(project_dir) if item_pipelines is None else item_pipelines, **{'scrapy_pipelines.CleanNewsPipeline': 800})
+    command += ['-s', f'ITEM_PIPELINES={json.dumps(item_pipelines)}',
+                '-s', f'CLEAN_NEWS_NORMALIZATION_CACHE={os.path.abspath(f"{months_dir}/normalization-cache.sqlite")}',
+                '-s', f'CLEAN_NEWS_NEAR_DUPLICATES={os.path.abspath(f"{months_dir}/near-duplicates.sqlite")}',
+                '-s', f'CLEAN_NEWS_PARTITION=news-{partition}']
+    environment = dict(os.environ, PYTHONPATH = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), os.environ.get('PYTHONPATH')])))
+
+  with open(f'{months_dir}/news-{partition}.log', 'w') as log_file:
+    completed = subprocess.run(command, cwd = project_dir, env = environment, stdout = log_file, stderr = subprocess.STDOUT)
+
+  if completed.returncode != 0:
+    return False
+
+  # scrapy writes no file for a month without news
+  if not os.path.exists(partial_path):
+    open(partial_path, 'w').close()
+
+  os.replace(partial_path, output_path)
+  return True
+
+def reusable_partition(partition, months_dir, manifest = None, partitions_key = None, crawl_mode = None):
+  output_path = f'{months_dir}/news-{partition}.csv'
+
+  # A month that is not over yet may still get news, so it is always crawled again
+  if not os.path.exists(output_path) or partition >= date.today().strftime('%Y-%m'):
+    return False
+
+  # With a manifest, a month file that does not match what was crawled (e.g. edited or truncated, or crawled
+  # with or without cleaning the items) is stale
+  return manifest is None or manifest.is_current('crawl', partition, partitions_key, input_hash = crawl_mode, output_hash = file_hash(output_path))
+
+def merge_partitions(partitions, months_dir, output_dir, manifest = None, partitions_key = None, cleaned_items = False):
+  os.makedirs(output_dir, exist_ok = True)
+
+  partitions_by_year = {}
+  for partition in partitions:
+    partitions_by_year.setdefault(partition[:4], []).append(partition)
+
+  for year, year_partitions in partitions_by_year.items():
+    month_news = [pd.read_csv(f'{months_dir}/news-{partition}.csv') for partition in year_partitions
+                  if os.path.getsize(f'{months_dir}/news-{partition}.csv') > 0]
+
+    output_path = f'{output_dir}/news-{year}.csv'
+    if month_news:
+      pd.concat(month_news, ignore_index = True).to_csv(f'{output_path}.partial', index = False)
+
+      # The yearly files are cleaned in place: if the merged news did not change since the year was
+      # cleaned, and the cleaned file is still there, it is kept so the cleaning is not done again
+      if manifest is not None and os.path.exists(output_path):
+        cleaned = manifest.get('clean', year, partitions_key)
+        if (cleaned is not None and cleaned['input_hash'] == file_hash(f'{output_path}.partial')
+            and cleaned['output_hash'] == file_hash(output_path)):
+          os.remove(f'{output_path}.partial')
+          continue
+
+      os.replace(f'{output_path}.partial', output_path)
+
+      # Months crawled with their items cleaned merge into an already clean year
+      if manifest is not None and cleaned_items:
+        merged_hash = file_hash(output_path)
+        manifest.record('clean', year, partitions_key, merged_hash, merged_hash)
+    elif os.path.exists(output_path):
+      os.remove(output_path)
+
+  # Years left from a previous, wider crawl
+  for file_name in os.listdir(output_dir):
+    if file_name.startswith('news-') and file_name.endswith('.csv') and file_name[5:-4] not in partitions_by_year:
+      os.remove(f'{output_dir}/{file_name}')
+
+def crawl_news(search_terms, start_date, end_date, output_dir = 'news', months_dir = 'news_months', project_dir = 'portafolio_news_scraper',
+               max_workers = 4, spider = 'news', manifest = None, clean_items = False):
+
+  partitions = month_partitions(start_date, end_date)
+
+  # Months already crawled for the same search terms are reused, so an interrupted or extended crawl only fetches what is missing
+  partitions_key = terms_key(search_terms)
+  months_dir = f'{months_dir}/{partitions_key}'
+  os.makedirs(months_dir, exist_ok = True)
+
+  crawl_mode = f'{partitions_key}/clean' if clean_items else partitions_key
+  pending = [partition for partition in partitions if not reusable_partition(partition, months_dir, manifest, partitions_key, crawl_mode)]
+  print(f'MESES A DESCARGAR: {len(pending)} DE {len(partitions)}')
+
+  item_pipelines = None
+  if clean_items:
+    item_pipelines = project_item_pipelines(project_dir)
+    near_duplicates = NearDuplicateIndex(f'{months_dir}/near-duplicates.sqlite')
+    near_duplicates.prune(f'news-{partition}' for partition in partitions)
+    near_duplicates.close()
+
+  with ThreadPoolExecutor(max_workers = max_workers) as executor:
+    crawled = list(executor.map(lambda partition: crawl_partition(search_terms, partition, months_dir, project_dir, spider, clean_items,
+                                                                  item_pipelines), pending))
+
+  # Recorded from this thread: the sqlite connection is not shared with the crawl threads
+  if manifest is not None:
+    for partition, partition_crawled in zip(pending, crawled):
+      if partition_crawled:
+        manifest.record('crawl', partition, partitions_key, crawl_mode, file_hash(f'{months_dir}/news-{partition}.csv'))
+
+  failed = [partition for partition, partition_crawled in zip(pending, crawled) if not partition_crawled]
+  for partition in failed:
+    print(f'¡ERROR!: LAS NOTICIAS DE {partition} NO PUDIERON SER DESCARGADAS. DETALLE EN {months_dir}/news-{partition}.log')
+
+  if not failed:
+    merge_partitions(partitions, months_dir, output_dir, manifest, partitions_key, clean_items)
+
+  return failed
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Descarga las noticias de un periodo, un mes por proceso de scrapy')
+  parser.add_argument('start_date', help = 'Mes inicial, YYYY-MM')
+  parser.add_argument('end_date', help = 'Mes final, YYYY-MM')
+  parser.add_argument('--search-terms', default = '', help = 'Términos de búsqueda separados por comas (vacío: todas las noticias)')
+  parser.add_argument('--output-dir', default = 'news')
+  parser.add_argument('--project-dir', default = 'portafolio_news_scraper')
+  parser.add_argument('--max-workers', type = int, default = 4)
+  parser.add_argument('--clean', action = 'store_true', help = 'Limpia y filtra las noticias mientras se descargan')
+  parser.add_argument('--manifest', default = 'manifest.sqlite', help = 'Registro de los meses descargados (vacío: sin registro)')
+  args = parser.parse_args()
+
+  search_terms = [search_term.strip().upper() for search_term in args.search_terms.split(',') if search_term.strip()]
+  manifest = Manifest(args.manifest) if args.manifest else None
+  failed = crawl_news(search_terms, args.start_date, args.end_date, output_dir = args.output_dir, project_dir = args.project_dir,
+                      max_workers = args.max_workers, manifest = manifest, clean_items = args.clean)
+
+  if manifest is not None:
+    print(f'ÚLTIMO MES DESCARGADO: {manifest.watermark("crawl", terms_key(search_terms))}')
+    manifest.close()
+  sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+  main()
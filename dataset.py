@@ -0,0 +1,75 @@
+import os
+import shutil
+
+import pandas as pd
+
+DATE_COLUMN = 'news_date'
+PARTITION_COLUMNS = ['year', 'month']
+# Always text: a column that is empty in every row of a year would otherwise be read from the csv as float NaN
+TEXT_COLUMNS = ['news_title', 'news_subtitle', 'news_text_content', DATE_COLUMN, 'search_term']
+CATEGORICAL_COLUMNS = ['search_term', 'news_title_english_label_finbert', 'news_subtitle_english_label_finbert']
+
+def write_partition(dataframe, dataset_dir, year, date_column = DATE_COLUMN):
+
+  dataframe = dataframe.copy()
+
+  # Text keeps the str form every stage used to get from astype(str); numbers keep their real dtypes
+  text_columns = list(dataframe.select_dtypes(include = 'object').columns) + [column for column in TEXT_COLUMNS + [date_column] if column in dataframe.columns]
+  for column in dict.fromkeys(text_columns):
+    dataframe[column] = dataframe[column].astype(str)
+
+  for column in CATEGORICAL_COLUMNS:
+    if column in dataframe.columns:
+      dataframe[column] = dataframe[column].astype('category')
+
+  # Month 0 holds the rows whose date is missing or could not be parsed
+  if date_column in dataframe.columns:
+    months = pd.to_datetime(dataframe[date_column], errors = 'coerce').dt.month.fillna(0).astype(int)
+  else:
+    months = pd.Series(0, index = dataframe.index)
+
+  year_dir = f'{dataset_dir}/year={year}'
+  if os.path.exists(year_dir):
+    shutil.rmtree(year_dir)
+
+  for month, month_dataframe in dataframe.groupby(months.values, sort = True):
+    month_dir = f'{year_dir}/month={month:02d}'
+    os.makedirs(month_dir)
+    month_dataframe.to_parquet(f'{month_dir}/part-0.parquet', index = False)
+
+def read_partition(dataset_dir, year = None, columns = None):
+
+  import pyarrow.parquet as pq
+
+  filters = None if year is None else [('year', '=', int(year))]
+  table = pq.read_table(dataset_dir, columns = columns, filters = filters, partitioning = 'hive')
+
+  dataframe = table.to_pandas()
+  if columns is None:
+    dataframe = dataframe.drop(columns = [column for column in PARTITION_COLUMNS if column in dataframe.columns])
+
+  return dataframe
+
+def csv_to_partition(csv_filename, dataset_dir, year, date_column = DATE_COLUMN):
+  write_partition(pd.read_csv(csv_filename), dataset_dir, year, date_column)
+
+def partition_files(dataset_dir):
+  return sorted(f'{current_dir}/{current_file}'.replace(os.sep, '/')
+                for current_dir, _, current_files in os.walk(dataset_dir)
+                for current_file in current_files if current_file.endswith('.parquet'))
+
+def dataset_columns(dataset_dir):
+
+  import pyarrow.parquet as pq
+
+  return list(dict.fromkeys(column for partition_file in partition_files(dataset_dir) for column in pq.read_schema(partition_file).names))
+
+def prune_partitions(dataset_dir, years):
+  if not os.path.exists(dataset_dir):
+    return
+
+  # Years left from a previous run over a wider period
+  years = {f'year={year}' for year in years}
+  for year_dir in os.listdir(dataset_dir):
+    if year_dir.startswith('year=') and year_dir not in years:
+      shutil.rmtree(f'{dataset_dir}/{year_dir}')
@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+VADER_LABELS = ['pos', 'neu', 'neg', 'compound']
+TEXTBLOB_LABELS = ['polarity', 'subjectivity']
+
+# Loaded once per process: in the pool every worker loads its own copy when it starts
+_vader_analyzer = None
+
+def _get_vader():
+  global _vader_analyzer
+  if _vader_analyzer is None:
+    from nltk.sentiment import SentimentIntensityAnalyzer
+    _vader_analyzer = SentimentIntensityAnalyzer()
+  return _vader_analyzer
+
+def _load_models():
+  from textblob import TextBlob
+
+  _get_vader()
+  TextBlob('').sentiment
+
+def vader_scores(texts, analyzer = None):
+  analyzer = analyzer or _get_vader()
+  scores = np.empty((len(texts), len(VADER_LABELS)), dtype = np.float64)
+  for text_idx, text in enumerate(texts):
+    polarity = analyzer.polarity_scores(text)
+    scores[text_idx] = [polarity[label] for label in VADER_LABELS]
+  return scores
+
+def textblob_scores(texts):
+  from textblob import TextBlob
+
+  scores = np.empty((len(texts), len(TEXTBLOB_LABELS)), dtype = np.float64)
+  for text_idx, text in enumerate(texts):
+    scores[text_idx] = TextBlob(text).sentiment
+  return scores
+
+class LexiconPool:
+
+  def __init__(self, max_workers = None, chunksize = 500, min_parallel = 2000):
+    self.max_workers = max_workers or os.cpu_count()
+    self.chunksize = chunksize
+    self.min_parallel = min_parallel
+    self.executor = None
+    self.lock = threading.Lock()
+
+  def vader(self, texts):
+    return self._map(vader_scores, list(texts), len(VADER_LABELS))
+
+  def textblob(self, texts):
+    return self._map(textblob_scores, list(texts), len(TEXTBLOB_LABELS))
+
+  def close(self):
+    with self.lock:
+      if self.executor is not None:
+        self.executor.shutdown()
+        self.executor = None
+
+  def _map(self, function, texts, width):
+    # Starting the workers costs more than scoring a few titles in this process
+    if len(texts) < self.min_parallel:
+      return function(texts)
+
+    chunks = [texts[start: start + self.chunksize] for start in range(0, len(texts), self.chunksize)]
+    return np.vstack([np.empty((0, width))] + list(self._get_executor().map(function, chunks)))
+
+  def _get_executor(self):
+    with self.lock:
+      if self.executor is None:
+        # Created on first use, usually from a pipeline stage thread while other threads run: forking then could copy a
+        # lock held by another thread, so the workers are spawned (and load their models in _load_models)
+        self.executor = ProcessPoolExecutor(max_workers = self.max_workers, mp_context = multiprocessing.get_context('spawn'), initializer = _load_models)
+      return self.executor
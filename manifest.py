@@ -0,0 +1,51 @@
+import os
+import sqlite3
+import time
+
+from dataset import partition_files
+from normalization import content_hash, file_hash
+
+# Stages recorded per partition: 'crawl' per month, 'clean' and 'sentiment' per year
+class Manifest:
+
+  def __init__(self, filename = 'manifest.sqlite'):
+    self.filename = filename
+    self.connection = sqlite3.connect(filename, timeout = 60)
+    self.connection.execute('''CREATE TABLE IF NOT EXISTS partitions (stage TEXT NOT NULL, partition TEXT NOT NULL, terms_key TEXT NOT NULL,
+                                                                     input_hash TEXT NOT NULL, output_hash TEXT NOT NULL, updated REAL NOT NULL,
+                                                                     PRIMARY KEY (stage, partition, terms_key))''')
+
+  def close(self):
+    self.connection.close()
+
+  def get(self, stage, partition, terms_key):
+    stored = self.connection.execute('SELECT input_hash, output_hash, updated FROM partitions WHERE stage = ? AND partition = ? AND terms_key = ?',
+                                     (stage, str(partition), terms_key)).fetchone()
+    if stored is None:
+      return None
+    return dict(zip(['input_hash', 'output_hash', 'updated'], stored))
+
+  def record(self, stage, partition, terms_key, input_hash, output_hash):
+    with self.connection:
+      self.connection.execute('INSERT OR REPLACE INTO partitions (stage, partition, terms_key, input_hash, output_hash, updated) VALUES (?, ?, ?, ?, ?, ?)',
+                              (stage, str(partition), terms_key, input_hash, output_hash, time.time()))
+
+  def is_current(self, stage, partition, terms_key, input_hash = None, output_hash = None):
+    # Current: the stage already ran for the partition, on the same input, and its output was not replaced since
+    entry = self.get(stage, partition, terms_key)
+    return (entry is not None and (input_hash is None or entry['input_hash'] == input_hash)
+            and (output_hash is None or entry['output_hash'] == output_hash))
+
+  def watermark(self, stage, terms_key):
+    latest, = self.connection.execute('SELECT MAX(partition) FROM partitions WHERE stage = ? AND terms_key = ?', (stage, terms_key)).fetchone()
+    return latest
+
+def terms_key(search_terms):
+  return content_hash(','.join(sorted(set(search_terms))))[:12]
+
+def dataset_hash(dataset_dir, year):
+  year_dir = f'{dataset_dir}/year={year}'
+  if not os.path.exists(year_dir):
+    return None
+
+  return content_hash('\n'.join(f'{os.path.relpath(file_name, year_dir)}:{file_hash(file_name)}' for file_name in partition_files(year_dir)))
@@ -0,0 +1,149 @@
+import re
+
+MAX_DISTANCE = 2
+
+class TermMatcher:
+
+  def __init__(self, search_terms, max_distance = MAX_DISTANCE):
+    self.max_distance = max_distance
+    self.search_terms = sorted(set(search_terms))
+
+    # A single word search term matches as a plain substring (see is_match), so all of them are
+    # compiled into one trie shaped regular expression that reports the longest term starting at
+    # every position. Shorter terms starting at that same position are prefixes of it.
+    self.always_matched = set()
+    single_terms = []
+    self.multi_terms = []
+
+    for search_term in self.search_terms:
+      search_term_parts = search_term.split()
+      # A single word with whitespace around it may not be a substring, and then is_match falls back to the token
+      # walk on the word alone: such a term is matched both ways
+      if len(search_term_parts) == 1 and search_term != search_term_parts[0]:
+        single_terms.append(search_term)
+        self.multi_terms.append((search_term, tuple(search_term_parts)))
+      elif len(search_term_parts) <= 1:
+        if search_term:
+          single_terms.append(search_term)
+        else:
+          self.always_matched.add(search_term)
+      else:
+        self.multi_terms.append((search_term, tuple(search_term_parts)))
+
+    self.single_pattern = None
+    self.prefix_closure = {}
+
+    if single_terms:
+      trie = {}
+      for search_term in single_terms:
+        node = trie
+        for char in search_term:
+          node = node.setdefault(char, {})
+        node[''] = search_term
+
+      self.single_pattern = re.compile(f'(?=({_trie_to_regex(trie)}))')
+      self.prefix_closure = {search_term: {other for other in single_terms if search_term.startswith(other)}
+                             for search_term in single_terms}
+
+    # Multi word search terms are matched token by token: every distinct term part goes into a
+    # character trie so that all the parts a token starts with are found in a single walk.
+    self.part_trie = {}
+    self.part_ids = {}
+    self.terms_by_part = {}
+    self.term_part_ids = []
+
+    for term_id, (search_term, search_term_parts) in enumerate(self.multi_terms):
+      part_ids = []
+      for part_str in search_term_parts:
+        if part_str not in self.part_ids:
+          part_id = len(self.part_ids)
+          self.part_ids[part_str] = part_id
+          node = self.part_trie
+          for char in part_str:
+            node = node.setdefault(char, {})
+          node[''] = part_id
+        part_id = self.part_ids[part_str]
+        part_ids.append(part_id)
+        self.terms_by_part.setdefault(part_id, set()).add(term_id)
+      self.term_part_ids.append(tuple(part_ids))
+
+    self.token_parts = {}
+
+  def prefix_parts(self, token):
+    if token in self.token_parts:
+      return self.token_parts[token]
+
+    found = []
+    node = self.part_trie
+    for char in token:
+      node = node.get(char)
+      if node is None:
+        break
+      if '' in node:
+        found.append(node[''])
+
+    found = frozenset(found)
+    self.token_parts[token] = found
+    return found
+
+  def find_all(self, text_content):
+    matched = set(self.always_matched)
+
+    if self.single_pattern is not None:
+      for longest in set(self.single_pattern.findall(text_content)):
+        matched.update(self.prefix_closure[longest])
+
+    if self.multi_terms:
+      matched.update(self.multi_terms[term_id][0] for term_id in self.match_multi_terms(text_content.split()))
+
+    return matched
+
+  def match_multi_terms(self, text_content_parts):
+    return self.walk((part_idx, self.prefix_parts(part_str)) for part_idx, part_str in enumerate(text_content_parts))
+
+  def walk(self, positioned_part_ids):
+    # Same greedy walk as is_match, run for every multi word term at once over (token position,
+    # part ids the token starts with) pairs. A term's state is only touched on tokens that start
+    # with one of its parts; a stale partial match is reset lazily, which is equivalent to is_match
+    # resetting it at the end of the token after the window closed.
+    found = set()
+    states = {}
+
+    for part_idx, part_ids in positioned_part_ids:
+      if not part_ids:
+        continue
+
+      candidates = set()
+      for part_id in part_ids:
+        candidates.update(self.terms_by_part[part_id])
+
+      for term_id in candidates - found:
+        idx, idx_found = states.get(term_id, (0, None))
+
+        if idx and idx_found + self.max_distance < part_idx - 1:
+          idx = 0
+
+        term_part_ids = self.term_part_ids[term_id]
+        if term_part_ids[idx] in part_ids:
+          idx += 1
+          if idx == len(term_part_ids):
+            found.add(term_id)
+            continue
+          states[term_id] = (idx, part_idx)
+        elif idx == 0:
+          states.pop(term_id, None)
+
+    return found
+
+def _trie_to_regex(node):
+  alternatives = [re.escape(char) + _trie_to_regex(child) for char, child in sorted(node.items()) if char]
+
+  if not alternatives:
+    return ''
+
+  pattern = alternatives[0] if len(alternatives) == 1 else f'(?:{"|".join(alternatives)})'
+
+  if '' in node:
+    return f'(?:{pattern})?'
+
+  return pattern
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+
+from lexicon_scoring import LexiconPool
+from scoring import FinbertScorer, OnnxModel, PysentimientoScorer, ScoreCache, SentimentSpanishScorer, TextBlobScorer, VaderScorer, export_onnx
+from spanish_scoring import SentimentSpanishPool
+
+FINBERT_MODEL = 'yiyanghkust/finbert-tone'
+
+# Only the NLTK data the scorers use, with the path nltk.data.find looks for
+NLTK_RESOURCES = {'vader_lexicon': 'sentiment/vader_lexicon.zip', 'punkt': 'tokenizers/punkt'}
+
+def ensure_nltk_data(*packages):
+  import nltk
+
+  for package in packages:
+    try:
+      nltk.data.find(NLTK_RESOURCES[package])
+    except LookupError:
+      nltk.download(package, quiet = True)
+
+def resident_memory():
+  try:
+    import psutil
+  except ImportError:
+    return None
+  return psutil.Process().memory_info().rss
+
+class ModelRegistry:
+
+  def __init__(self, log = None):
+    self.log = log
+    self.factories = {}
+    self.models = {}
+    self.load_stats = {}
+    # Reentrant: a factory loads the models it depends on through the same registry
+    self.lock = threading.RLock()
+
+  def register(self, name, factory):
+    self.factories[name] = factory
+
+  def get(self, name):
+    with self.lock:
+      if name not in self.models:
+        if name not in self.factories:
+          raise KeyError(f'Modelo no registrado: {name}. Modelos disponibles: {sorted(self.factories)}')
+
+        memory_before = resident_memory()
+        started = time.perf_counter()
+        self.models[name] = self.factories[name](self)
+        seconds = time.perf_counter() - started
+        memory_after = resident_memory()
+
+        self.load_stats[name] = {'seconds': seconds, 'rss': memory_after,
+                                 'rss_delta': None if memory_before is None else memory_after - memory_before}
+        self._report(name)
+
+      return self.models[name]
+
+  def loaded(self):
+    return list(self.models)
+
+  def _report(self, name):
+    stats = self.load_stats[name]
+    message = f'MODELO {name.upper()} CARGADO EN {stats["seconds"]:.1f} s'
+    if stats['rss'] is not None:
+      message += f' (MEMORIA RESIDENTE: {stats["rss"] / 2 ** 20:.0f} MB, {stats["rss_delta"] / 2 ** 20:+.0f} MB)'
+
+    if self.log is not None:
+      self.log.Info(message)
+    else:
+      print(message)
+
+def default_registry(score_cache_filename = 'score-cache.sqlite', num_threads = None, use_onnx = False, onnx_dir = 'onnx_models', log = None):
+
+  num_threads = num_threads or os.cpu_count()
+  registry = ModelRegistry(log)
+
+  def lexicon_pool(models):
+    ensure_nltk_data('vader_lexicon', 'punkt')
+    return LexiconPool(max_workers = num_threads)
+
+  def pysentimiento_analyzer(models):
+    from pysentimiento import create_analyzer
+    return create_analyzer(task = 'sentiment', lang = 'es')
+
+  def pysentimiento_onnx(models):
+    analyzer = models.get('pysentimiento_analyzer')
+    export_dir = f'{onnx_dir}/pysentimiento'
+    if not os.path.exists(f'{export_dir}/model.json'):
+      export_onnx(analyzer.model, export_dir)
+    return PysentimientoScorer(analyzer, model = OnnxModel(export_dir, num_threads = num_threads), score_cache = models.get('score_cache'))
+
+  def finbert_model(models):
+    from transformers import BertForSequenceClassification
+    return BertForSequenceClassification.from_pretrained(FINBERT_MODEL, num_labels = 3)
+
+  def finbert_tokenizer(models):
+    from transformers import BertTokenizer
+    return BertTokenizer.from_pretrained(FINBERT_MODEL)
+
+  def finbert_onnx(models):
+    export_dir = f'{onnx_dir}/finbert'
+    if not os.path.exists(f'{export_dir}/model.json'):
+      export_onnx(models.get('finbert_model'), export_dir)
+    return FinbertScorer(OnnxModel(export_dir, num_threads = num_threads), models.get('finbert_tokenizer'), score_cache = models.get('score_cache'))
+
+  registry.register('score_cache', lambda models: ScoreCache(score_cache_filename))
+  registry.register('lexicon_pool', lexicon_pool)
+  registry.register('vader', lambda models: VaderScorer(score_cache = models.get('score_cache'), pool = models.get('lexicon_pool')))
+  registry.register('textblob', lambda models: TextBlobScorer(score_cache = models.get('score_cache'), pool = models.get('lexicon_pool')))
+  registry.register('sentiment_spanish', lambda models: SentimentSpanishScorer(score_cache = models.get('score_cache'),
+                                                                               pool = SentimentSpanishPool(max_workers = num_threads)))
+
+  registry.register('pysentimiento_analyzer', pysentimiento_analyzer)
+  registry.register('pysentimiento_torch', lambda models: PysentimientoScorer(models.get('pysentimiento_analyzer'), num_threads = num_threads,
+                                                                              score_cache = models.get('score_cache')))
+  registry.register('pysentimiento_onnx', pysentimiento_onnx)
+  registry.register('pysentimiento', lambda models: models.get('pysentimiento_onnx' if use_onnx else 'pysentimiento_torch'))
+
+  registry.register('finbert_model', finbert_model)
+  registry.register('finbert_tokenizer', finbert_tokenizer)
+  registry.register('finbert_torch', lambda models: FinbertScorer(models.get('finbert_model'), models.get('finbert_tokenizer'), num_threads = num_threads,
+                                                                  score_cache = models.get('score_cache')))
+  registry.register('finbert_onnx', finbert_onnx)
+  registry.register('finbert', lambda models: models.get('finbert_onnx' if use_onnx else 'finbert_torch'))
+
+  return registry
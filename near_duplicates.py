@@ -0,0 +1,83 @@
+import sqlite3
+import zlib
+
+import numpy as np
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+class NearDuplicateIndex:
+
+  def __init__(self, filename = 'news/near-duplicates.sqlite', num_perm = 128, bands = 32, threshold = 0.8, shingle_size = 5, seed = 1):
+    if num_perm % bands:
+      raise ValueError(f'num_perm ({num_perm}) debe ser múltiplo de bands ({bands})')
+
+    self.filename = filename
+    self.num_perm = num_perm
+    self.bands = bands
+    self.rows_per_band = num_perm // bands
+    self.threshold = threshold
+    self.shingle_size = shingle_size
+
+    generator = np.random.RandomState(seed)
+    self.permutation_a = generator.randint(1, (1 << 61) - 1, size = num_perm, dtype = np.uint64)
+    self.permutation_b = generator.randint(0, (1 << 61) - 1, size = num_perm, dtype = np.uint64)
+
+    self.connection = sqlite3.connect(filename, timeout = 60)
+    self.connection.executescript('''
+      CREATE TABLE IF NOT EXISTS signatures (doc_key TEXT PRIMARY KEY, partition TEXT NOT NULL, signature BLOB NOT NULL);
+      CREATE TABLE IF NOT EXISTS buckets (band INTEGER NOT NULL, bucket BLOB NOT NULL, doc_key TEXT NOT NULL);
+      CREATE INDEX IF NOT EXISTS buckets_band_bucket ON buckets (band, bucket);
+    ''')
+
+  def close(self):
+    self.connection.close()
+
+  def prune(self, partitions):
+    # Articles of partitions that are no longer processed must not drop their near duplicates from the ones that are
+    partitions = list(partitions)
+    placeholders = ', '.join('?' * len(partitions))
+    with self.connection:
+      self.connection.execute(f'DELETE FROM buckets WHERE doc_key IN (SELECT doc_key FROM signatures WHERE partition NOT IN ({placeholders}))', partitions)
+      self.connection.execute(f'DELETE FROM signatures WHERE partition NOT IN ({placeholders})', partitions)
+
+  def signature(self, text):
+    words = text.split()
+    shingles = {' '.join(words[start: start + self.shingle_size]) for start in range(max(len(words) - self.shingle_size + 1, 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype = np.uint64, count = len(shingles))
+
+    with np.errstate(over = 'ignore'):
+      permuted = np.bitwise_and((np.outer(hashes, self.permutation_a) + self.permutation_b) % MERSENNE_PRIME, MAX_HASH)
+
+    return permuted.min(axis = 0).astype(np.uint32)
+
+  def keep(self, doc_keys, texts, partition):
+    # The write lock is taken before looking for duplicates: processes sharing the index (e.g. the months crawled at
+    # the same time) could otherwise both miss each other's near duplicate and keep both
+    with self.connection:
+      self.connection.execute('BEGIN IMMEDIATE')
+      return [self._find_duplicate(doc_key, text, partition) is None for doc_key, text in zip(doc_keys, texts)]
+
+  def _find_duplicate(self, doc_key, text, partition):
+    stored = self.connection.execute('SELECT partition FROM signatures WHERE doc_key = ?', (doc_key,)).fetchone()
+    if stored is not None:
+      # The same article seen in another partition is a duplicate; in the same partition it is a rerun
+      return None if stored[0] == partition else doc_key
+
+    signature = self.signature(text)
+    band_buckets = [(band, signature[band * self.rows_per_band: (band + 1) * self.rows_per_band].tobytes()) for band in range(self.bands)]
+
+    candidates = set()
+    for band, bucket in band_buckets:
+      candidates.update(key for key, in self.connection.execute('SELECT doc_key FROM buckets WHERE band = ? AND bucket = ?', (band, bucket)))
+
+    for candidate in sorted(candidates):
+      candidate_signature, = self.connection.execute('SELECT signature FROM signatures WHERE doc_key = ?', (candidate,)).fetchone()
+      if np.mean(np.frombuffer(candidate_signature, dtype = np.uint32) == signature) >= self.threshold:
+        return candidate
+
+    self.connection.execute('INSERT INTO signatures (doc_key, partition, signature) VALUES (?, ?, ?)', (doc_key, partition, signature.tobytes()))
+    self.connection.executemany('INSERT INTO buckets (band, bucket, doc_key) VALUES (?, ?, ?)',
+                                ((band, bucket, doc_key) for band, bucket in band_buckets))
+
+    return None
@@ -0,0 +1,191 @@
+import math
+import os
+import sqlite3
+
+import pandas as pd
+
+from cache_store import SQLITE_MAX_PARAMS
+from matcher import MAX_DISTANCE, TermMatcher
+from normalization import content_hash, file_hash, normalize_text
+
+class NewsIndex:
+
+  def __init__(self, index_filename = 'news_index.sqlite', max_distance = MAX_DISTANCE):
+    self.index_filename = index_filename
+    self.max_distance = max_distance
+    self.connection = sqlite3.connect(index_filename, timeout = 60)
+    self.connection.executescript('''
+      CREATE TABLE IF NOT EXISTS files (file_name TEXT PRIMARY KEY, file_hash TEXT NOT NULL);
+      CREATE TABLE IF NOT EXISTS documents (doc_id INTEGER PRIMARY KEY, content_hash TEXT NOT NULL UNIQUE);
+      CREATE TABLE IF NOT EXISTS rows (file_name TEXT NOT NULL, row_number INTEGER NOT NULL, doc_id INTEGER NOT NULL,
+                                       PRIMARY KEY (file_name, row_number));
+      CREATE TABLE IF NOT EXISTS vocabulary (token TEXT PRIMARY KEY);
+      CREATE TABLE IF NOT EXISTS postings (token TEXT NOT NULL, doc_id INTEGER NOT NULL, positions TEXT NOT NULL,
+                                           PRIMARY KEY (token, doc_id));
+      CREATE INDEX IF NOT EXISTS rows_doc_id ON rows (doc_id);
+      CREATE INDEX IF NOT EXISTS postings_doc_id ON postings (doc_id);
+    ''')
+
+  def close(self):
+    self.connection.close()
+
+  def update(self, file_path, chunksize = 10000):
+    file_name = os.path.basename(file_path)
+    current_hash = file_hash(file_path)
+
+    stored = self.connection.execute('SELECT file_hash FROM files WHERE file_name = ?', (file_name,)).fetchone()
+    if stored is not None and stored[0] == current_hash:
+      return False
+
+    with self.connection:
+      self.connection.execute('DELETE FROM rows WHERE file_name = ?', (file_name,))
+
+      row_number = 0
+      for chunk in pd.read_csv(file_path, usecols = ['news_text_content'], chunksize = chunksize):
+        contents = chunk['news_text_content'].astype(str)
+        rows = []
+        for content in contents:
+          rows.append((file_name, row_number, self._document_id(normalize_text(content))))
+          row_number += 1
+        self.connection.executemany('INSERT INTO rows (file_name, row_number, doc_id) VALUES (?, ?, ?)', rows)
+
+      self._drop_orphan_documents()
+      self.connection.execute('INSERT OR REPLACE INTO files (file_name, file_hash) VALUES (?, ?)', (file_name, current_hash))
+
+    return True
+
+  def update_all(self, dir_name = 'news'):
+    current_files = sorted(current_file for current_file in os.listdir(dir_name) if current_file.startswith('news-') and current_file.endswith('.csv'))
+    updated = [current_file for current_file in current_files if self.update(f'{dir_name}/{current_file}')]
+
+    # Rows of files that were deleted (e.g. years outside the crawled period) would point to news that no longer exist
+    removed = [file_name for file_name, in self.connection.execute('SELECT file_name FROM files').fetchall() if file_name not in current_files]
+    if removed:
+      with self.connection:
+        for file_name in removed:
+          self.connection.execute('DELETE FROM rows WHERE file_name = ?', (file_name,))
+          self.connection.execute('DELETE FROM files WHERE file_name = ?', (file_name,))
+        self._drop_orphan_documents()
+
+    return updated
+
+  def search(self, search_term):
+    search_term = normalize_text(search_term)
+    search_term_parts = search_term.split()
+
+    if not search_term:
+      return {doc_id for doc_id, in self.connection.execute('SELECT doc_id FROM documents')}
+
+    if len(search_term_parts) == 0 or (len(search_term_parts) == 1 and search_term == search_term_parts[0]):
+      tokens = [token for token, in self.connection.execute('SELECT token FROM vocabulary WHERE instr(token, ?) > 0', (search_term,))]
+      return {doc_id for _, doc_id, _ in self._postings(tokens)}
+
+    # A single word with whitespace around it goes through the token walk on the word, as in is_match (and TermMatcher).
+    # With whitespace before the word its substring check only finds tokens the walk already does; with whitespace only
+    # after it, it also finds the word at the end of a token followed by another one. The index keeps the tokens, not the
+    # whitespace: one whitespace character between tokens and none around the text is assumed
+    doc_ids = set()
+    if len(search_term_parts) == 1 and not search_term[0].isspace():
+      doc_ids = self._token_suffix_matches(search_term_parts[0])
+
+    matcher = TermMatcher([search_term], self.max_distance)
+    positions_by_doc = None
+
+    for part_str, part_id in matcher.part_ids.items():
+      tokens = [token for token, in self.connection.execute('SELECT token FROM vocabulary WHERE token >= ? AND token < ?',
+                                                            (part_str, _prefix_upper_bound(part_str)))]
+      part_positions = {}
+      for _, doc_id, positions in self._postings(tokens):
+        doc_positions = part_positions.setdefault(doc_id, {})
+        for position in positions.split():
+          doc_positions.setdefault(int(position), set()).add(part_id)
+
+      if positions_by_doc is None:
+        positions_by_doc = part_positions
+      else:
+        positions_by_doc = {doc_id: _merge_positions(positions_by_doc[doc_id], part_positions[doc_id])
+                            for doc_id in positions_by_doc.keys() & part_positions.keys()}
+
+    return doc_ids | {doc_id for doc_id, doc_positions in positions_by_doc.items()
+                      if matcher.walk((position, doc_positions[position]) for position in sorted(doc_positions))}
+
+  def rows(self, search_term):
+    matching_rows = {}
+    doc_ids = sorted(self.search(search_term))
+
+    for start in range(0, len(doc_ids), SQLITE_MAX_PARAMS):
+      doc_ids_chunk = doc_ids[start: start + SQLITE_MAX_PARAMS]
+      placeholders = ','.join('?' * len(doc_ids_chunk))
+      for file_name, row_number in self.connection.execute(f'SELECT file_name, row_number FROM rows WHERE doc_id IN ({placeholders})', doc_ids_chunk):
+        matching_rows.setdefault(file_name, []).append(row_number)
+
+    return {file_name: sorted(row_numbers) for file_name, row_numbers in matching_rows.items()}
+
+  def matching_news(self, search_term, dir_name = 'news', chunksize = 10000):
+    all_news = []
+    for file_name, row_numbers in sorted(self.rows(search_term).items()):
+      for chunk in pd.read_csv(f'{dir_name}/{file_name}', chunksize = chunksize):
+        current_news = chunk[chunk.index.isin(row_numbers)].copy()
+        current_news['search_term'] = search_term
+        all_news.append(current_news)
+
+    if not all_news:
+      return pd.DataFrame()
+
+    return pd.concat(all_news, ignore_index = True).drop_duplicates(subset = ['news_title', 'news_subtitle', 'news_text_content'])
+
+  def _document_id(self, normalized_content):
+    normalized_hash = content_hash(normalized_content)
+
+    stored = self.connection.execute('SELECT doc_id FROM documents WHERE content_hash = ?', (normalized_hash,)).fetchone()
+    if stored is not None:
+      return stored[0]
+
+    doc_id = self.connection.execute('INSERT INTO documents (content_hash) VALUES (?)', (normalized_hash,)).lastrowid
+
+    positions = {}
+    for part_idx, part_str in enumerate(normalized_content.split()):
+      positions.setdefault(part_str, []).append(str(part_idx))
+
+    self.connection.executemany('INSERT OR IGNORE INTO vocabulary (token) VALUES (?)', ((token,) for token in positions))
+    self.connection.executemany('INSERT INTO postings (token, doc_id, positions) VALUES (?, ?, ?)',
+                                ((token, doc_id, ' '.join(token_positions)) for token, token_positions in positions.items()))
+
+    return doc_id
+
+  def _drop_orphan_documents(self):
+    orphan_filter = 'doc_id NOT IN (SELECT doc_id FROM rows)'
+    self.connection.execute(f'DELETE FROM postings WHERE {orphan_filter}')
+    self.connection.execute(f'DELETE FROM documents WHERE {orphan_filter}')
+    self.connection.execute('DELETE FROM vocabulary WHERE token NOT IN (SELECT token FROM postings)')
+
+  def _token_suffix_matches(self, word):
+    tokens = [token for token, in self.connection.execute('SELECT token FROM vocabulary WHERE substr(token, -?) = ?', (len(word), word))]
+
+    first_positions = {}
+    for _, doc_id, positions in self._postings(tokens):
+      first_positions[doc_id] = min(first_positions.get(doc_id, math.inf), min(map(int, positions.split())))
+
+    # The token must not be the last of the document
+    matched = set()
+    for doc_id, first_position in first_positions.items():
+      last_position = max(int(position) for positions, in self.connection.execute('SELECT positions FROM postings WHERE doc_id = ?', (doc_id,))
+                          for position in positions.split())
+      if first_position < last_position:
+        matched.add(doc_id)
+    return matched
+
+  def _postings(self, tokens):
+    for start in range(0, len(tokens), SQLITE_MAX_PARAMS):
+      tokens_chunk = tokens[start: start + SQLITE_MAX_PARAMS]
+      placeholders = ','.join('?' * len(tokens_chunk))
+      yield from self.connection.execute(f'SELECT token, doc_id, positions FROM postings WHERE token IN ({placeholders})', tokens_chunk)
+
+def _merge_positions(left, right):
+  merged = {position: set(part_ids) for position, part_ids in left.items()}
+  for position, part_ids in right.items():
+    merged.setdefault(position, set()).update(part_ids)
+  return merged
+
+def _prefix_upper_bound(prefix):
+  return prefix[:-1] + chr(ord(prefix[-1]) + 1)
@@ -0,0 +1,40 @@
+import hashlib
+import unidecode
+
+from cache_store import SqliteCache
+
+def normalize_text(text):
+  return unidecode.unidecode(text).lower()
+
+def content_hash(text):
+  return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def file_hash(file_path):
+  digest = hashlib.sha1()
+  with open(file_path, 'rb') as file:
+    for block in iter(lambda: file.read(1 << 20), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+class NormalizationCache(SqliteCache):
+
+  def __init__(self, filename = 'news/normalization-cache.sqlite', memory_items = 10000):
+    super().__init__(filename, table = 'normalized_text', memory_items = memory_items)
+
+  def normalize_many(self, texts):
+    hashes = {text: content_hash(text) for text in dict.fromkeys(texts)}
+    stored = self.get_many(hashes.values())
+
+    normalized = {}
+    missing = {}
+    for text, text_hash in hashes.items():
+      if text_hash in stored:
+        normalized[text] = stored[text_hash]
+      else:
+        normalized[text] = missing[text_hash] = normalize_text(text)
+
+    self.put_many(missing)
+    return normalized
+
+def article_key(title, subtitle, text_content):
+  return content_hash('\x1f'.join((title, subtitle, text_content)))
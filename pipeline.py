@@ -0,0 +1,148 @@
+import os
+import shutil
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from dataset import read_partition, write_partition
+
+SPANISH_FIELDS = ['news_title', 'news_subtitle', 'news_text_content']
+ENGLISH_FIELDS = ['news_title_english', 'news_subtitle_english', 'news_text_content_english']
+
+class Stage:
+
+  def __init__(self, name, inputs, outputs, function):
+    self.name = name
+    self.inputs = list(inputs)
+    self.outputs = list(outputs)
+    self.function = function
+
+  def run(self, dataframe, partition):
+    # The function gets only its input columns and returns {output column: values}, aligned to them
+    result = self.function(dataframe[self.inputs], partition)
+    return pd.DataFrame({column: list(result[column]) for column in self.outputs}, index = dataframe.index)
+
+class Pipeline:
+
+  def __init__(self, stages, max_workers = 4):
+    self.stages = list(stages)
+    self.max_workers = max_workers
+    self.views = {}
+
+    names = [stage.name for stage in self.stages]
+    if len(set(names)) != len(names):
+      raise ValueError('Los nombres de las etapas deben ser únicos')
+
+    self.produced = {}
+    for stage in self.stages:
+      for column in stage.outputs:
+        if column in self.produced:
+          raise ValueError(f'La columna {column} es producida por {self.produced[column]} y por {stage.name}')
+        self.produced[column] = stage.name
+
+  def add_view(self, name, stage_names, drop = ()):
+    self.views[name] = (list(stage_names), list(drop))
+
+  def view_columns(self, name, columns):
+    # A view is the source columns (less the dropped ones) followed by the outputs of its stages
+    stage_names, drop = self.views[name]
+    stages = {stage.name: stage for stage in self.stages}
+    source_columns = [column for column in columns if column not in self.produced and column not in drop]
+    return source_columns + [column for stage_name in stage_names for column in stages[stage_name].outputs]
+
+  def run(self, dataframe, partition = None):
+    available = set(dataframe.columns)
+    results = {}
+    pending = list(self.stages)
+    running = {}
+
+    # Every stage starts as soon as all of its input columns exist, so stages that do not depend
+    # on each other (e.g. the Spanish models and the translation) run at the same time
+    with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+      while pending or running:
+        ready = [stage for stage in pending if available.issuperset(stage.inputs)]
+        if not ready and not running:
+          missing = {stage.name: sorted(set(stage.inputs) - available) for stage in pending}
+          raise ValueError(f'Etapas sin sus columnas de entrada: {missing}')
+
+        for stage in ready:
+          pending.remove(stage)
+          current_input = pd.concat([dataframe] + list(results.values()), axis = 1)
+          running[executor.submit(stage.run, current_input, partition)] = stage
+
+        done, _ = wait(running, return_when = FIRST_COMPLETED)
+        for future in done:
+          stage = running.pop(future)
+          results[stage.name] = future.result()
+          available.update(stage.outputs)
+
+    return pd.concat([dataframe] + [results[stage.name] for stage in self.stages], axis = 1)
+
+  def run_partition(self, dataset_dir, result_dir, year):
+    write_partition(self.run(read_partition(dataset_dir, year), year), result_dir, year)
+
+def score_stage(name, scorer, input_column, output_columns):
+
+  def score(dataframe, partition):
+    scores = scorer.score(dataframe[input_column])
+    return {column: scores[:, column_idx] for column_idx, column in enumerate(output_columns)}
+
+  return Stage(name, [input_column], output_columns, score)
+
+def label_stage(name, scorer, input_column, label_column, score_column):
+
+  def predict(dataframe, partition):
+    labels, scores = scorer.predict(dataframe[input_column])
+    return {label_column: labels, score_column: scores}
+
+  return Stage(name, [input_column], [label_column, score_column], predict)
+
+def joined_stage():
+
+  def join(dataframe, partition):
+    return {'news_joined': dataframe['news_title'] + '. ' + dataframe['news_subtitle'] + '. ' + dataframe['news_text_content']}
+
+  return Stage('news_joined', SPANISH_FIELDS, ['news_joined'], join)
+
+def translation_stage(parts_dir = 'news_english_parts', **translate_kwargs):
+
+  from toolbox import translate_news
+
+  def translate(dataframe, partition):
+    if dataframe.empty:
+      return {column: [] for column in ENGLISH_FIELDS}
+
+    # The parts are kept until the whole partition is translated, so an interrupted run resumes
+    os.makedirs(parts_dir, exist_ok = True)
+    news_location = f'{parts_dir}/news_english-{partition}'
+    news_english = translate_news(dataframe, news_location, resume = True, **translate_kwargs)
+    shutil.rmtree(news_location)
+    return news_english
+
+  return Stage('translation', SPANISH_FIELDS, ENGLISH_FIELDS, translate)
+
+def sentiment_pipeline(pysentimiento_scorer, sentiment_spanish_scorer, vader_scorer, textblob_scorer, finbert_scorer,
+                       max_workers = 4, **translate_kwargs):
+
+  pysent_stages = [score_stage(f'{field}_pysent', pysentimiento_scorer, field, [f'{field}_prob_{label}_pysent' for label in ['POS', 'NEU', 'NEG']])
+                   for field in SPANISH_FIELDS + ['news_joined']]
+  sentspanish_stages = [score_stage(f'{field}_sentspanish', sentiment_spanish_scorer, field, [f'{field}_sent_sentspanish'])
+                        for field in SPANISH_FIELDS + ['news_joined']]
+  nltk_stages = [score_stage(f'{field}_nltk', vader_scorer, field, [f'{field}_polarity_{label}_nltk' for label in ['POS', 'NEU', 'NEG', 'COM']])
+                 for field in ENGLISH_FIELDS]
+  textblob_stages = [score_stage(f'{field}_textblob', textblob_scorer, field, [f'{field}_pol_textblob', f'{field}_sub_textblob'])
+                     for field in ENGLISH_FIELDS]
+  finbert_stages = [label_stage(f'{field}_finbert', finbert_scorer, field, f'{field}_label_finbert', f'{field}_label_score_finbert')
+                    for field in ENGLISH_FIELDS[:2]]
+
+  pipeline = Pipeline([joined_stage(), translation_stage(**translate_kwargs)] + pysent_stages + sentspanish_stages
+                      + nltk_stages + textblob_stages + finbert_stages, max_workers)
+
+  # The views keep the columns (and order) of the datasets each step used to write on its own
+  pipeline.add_view('news_sentiment_spanish', [stage.name for stage in pysent_stages[:3] + sentspanish_stages[:3]])
+  pipeline.add_view('news_sentiment_spanish_joined', ['news_joined', pysent_stages[3].name, sentspanish_stages[3].name], drop = SPANISH_FIELDS)
+  pipeline.add_view('news_english', ['translation'], drop = SPANISH_FIELDS)
+  pipeline.add_view('news_sentiment_english', ['translation'] + [stage.name for stage in nltk_stages + textblob_stages + finbert_stages],
+                    drop = SPANISH_FIELDS)
+
+  return pipeline
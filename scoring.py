@@ -0,0 +1,358 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import numpy as np
+
+from cache_store import SqliteCache
+from lexicon_scoring import TEXTBLOB_LABELS, VADER_LABELS, textblob_scores, vader_scores
+from spanish_scoring import sentiment_spanish_scores
+from normalization import content_hash
+
+PYSENTIMIENTO_LABELS = ['POS', 'NEU', 'NEG']
+MAX_BATCH_TOKENS = 8192
+
+class ScoreCache(SqliteCache):
+
+  def __init__(self, filename = 'score-cache.sqlite', memory_items = 10000, max_bytes = None):
+    super().__init__(filename, table = 'scores', memory_items = memory_items, max_bytes = max_bytes)
+
+  def text_key(self, scorer, text):
+    return content_hash(f'{scorer.model_id}\x1f{scorer.revision}\x1f{text}')
+
+  def lookup(self, scorer, texts):
+    keys = {text: self.text_key(scorer, text) for text in dict.fromkeys(texts)}
+    stored = self.get_many(keys.values())
+    return {text: json.loads(stored[key]) for text, key in keys.items() if key in stored}
+
+  def store(self, scorer, scores):
+    self.put_many((self.text_key(scorer, text), json.dumps([float(value) for value in row])) for text, row in scores.items())
+
+class Scorer:
+
+  # Every scorer returns an (n, len(labels)) array aligned to its input; model_id and revision
+  # identify its results in the score cache, so a new model version never reuses old scores
+  model_id = None
+  revision = None
+  labels = []
+  score_cache = None
+
+  def score(self, texts):
+    texts = [str(text) for text in texts]
+    if not texts:
+      return np.zeros((0, len(self.labels)))
+
+    if self.score_cache is None:
+      return self._score(texts)
+
+    scores = self.score_cache.lookup(self, texts)
+    missing = [text for text in dict.fromkeys(texts) if text not in scores]
+    if missing:
+      computed = dict(zip(missing, self._score(missing)))
+      self.score_cache.store(self, computed)
+      scores.update(computed)
+
+    return np.array([scores[text] for text in texts], dtype = float)
+
+  def _score(self, texts):
+    raise NotImplementedError
+
+class VaderScorer(Scorer):
+
+  model_id = 'nltk-vader'
+  labels = VADER_LABELS
+
+  def __init__(self, analyzer = None, score_cache = None, pool = None):
+    self.analyzer = analyzer
+    self.revision = _package_version('nltk')
+    self.score_cache = score_cache
+    self.pool = pool
+
+  def _score(self, texts):
+    if self.pool is not None:
+      return self.pool.vader(texts)
+    return vader_scores(texts, self.analyzer)
+
+class TextBlobScorer(Scorer):
+
+  model_id = 'textblob-pattern'
+  labels = TEXTBLOB_LABELS
+
+  def __init__(self, score_cache = None, pool = None):
+    self.revision = _package_version('textblob')
+    self.score_cache = score_cache
+    self.pool = pool
+
+  def _score(self, texts):
+    if self.pool is not None:
+      return self.pool.textblob(texts)
+    return textblob_scores(texts)
+
+class SentimentSpanishScorer(Scorer):
+
+  model_id = 'sentiment-analysis-spanish'
+  labels = ['sentiment']
+
+  def __init__(self, analyzer = None, score_cache = None, pool = None):
+    self.analyzer = analyzer
+    self.revision = _package_version('sentiment-analysis-spanish')
+    self.score_cache = score_cache
+    self.pool = pool
+
+  def _score(self, texts):
+    if self.pool is not None:
+      return self.pool.score(texts)[:, None]
+    return sentiment_spanish_scores(texts, self.analyzer)[:, None]
+
+class ScoringStats:
+
+  def __init__(self, history = 1000):
+    self.batch_latencies = deque(maxlen = history)
+    self.reset()
+
+  def reset(self):
+    self.batch_latencies.clear()
+    self.batches = 0
+    self.texts = 0
+    self.windows = 0
+    self.tokens = 0
+    self.padded_tokens = 0
+    self.seconds = 0.0
+
+  def record(self, windows, tokens, padded_tokens, seconds):
+    self.batch_latencies.append(seconds)
+    self.batches += 1
+    self.windows += windows
+    self.tokens += tokens
+    self.padded_tokens += padded_tokens
+    self.seconds += seconds
+
+  @property
+  def mean_latency(self):
+    return self.seconds / self.batches if self.batches else 0.0
+
+  @property
+  def texts_per_second(self):
+    return self.texts / self.seconds if self.seconds else 0.0
+
+  @property
+  def tokens_per_second(self):
+    return self.tokens / self.seconds if self.seconds else 0.0
+
+  @property
+  def padding_ratio(self):
+    return 1 - self.tokens / self.padded_tokens if self.padded_tokens else 0.0
+
+def token_budget_batches(lengths, max_tokens = MAX_BATCH_TOKENS, max_batch_size = 256):
+  # Sequences sorted by length are cut into batches whose padded size (longest sequence times
+  # batch size) stays within max_tokens, so short titles go in large batches and bodies in small ones
+  order = sorted(range(len(lengths)), key = lambda idx: lengths[idx])
+  batch = []
+
+  for idx in order:
+    if batch and ((len(batch) + 1) * lengths[idx] > max_tokens or len(batch) == max_batch_size):
+      yield batch
+      batch = []
+    batch.append(idx)
+
+  if batch:
+    yield batch
+
+class TransformerScorer(Scorer):
+
+  def __init__(self, model, tokenizer, labels = None, max_length = 512, window_overlap = 64,
+               max_tokens = MAX_BATCH_TOKENS, max_batch_size = 256, num_threads = None, revision = None, score_cache = None):
+    import torch
+
+    if num_threads:
+      torch.set_num_threads(num_threads)
+
+    self.torch = torch
+    self.model = model.eval()
+    self.tokenizer = tokenizer
+    self.max_length = max_length
+    self.max_tokens = max_tokens
+    self.max_batch_size = max_batch_size
+    self.stats = ScoringStats()
+    self.score_cache = score_cache
+    # A model already uses every core it is given, and a fast tokenizer can not be shared between
+    # threads, so stages running in parallel take turns on the same scorer
+    self.lock = threading.Lock()
+
+    id2label = {int(label_id): label for label_id, label in self.model.config.id2label.items()}
+    self.labels = labels or [id2label[label_id] for label_id in sorted(id2label)]
+    label2id = {label: label_id for label_id, label in id2label.items()}
+    self.label_ids = [label2id[label] for label in self.labels]
+
+    self.window_size = max_length - tokenizer.num_special_tokens_to_add()
+    if window_overlap >= self.window_size:
+      raise ValueError(f'window_overlap ({window_overlap}) debe ser menor que el tamaño de la ventana ({self.window_size} tokens con max_length = {max_length})')
+    self.window_step = self.window_size - window_overlap
+
+    config = self.model.config
+    self.model_id = getattr(config, '_name_or_path', '') or type(self.model).__name__
+    revision = revision or getattr(config, '_commit_hash', None) or 'main'
+    self.revision = f'{revision}/{getattr(self.model, "backend", "torch")}/{max_length}/{window_overlap}'
+
+  def preprocess(self, text):
+    return str(text)
+
+  def windows(self, token_ids):
+    if len(token_ids) <= self.window_size:
+      return [token_ids]
+
+    last_start = len(token_ids) - self.window_size
+    starts = list(range(0, last_start, self.window_step)) + [last_start]
+    return [token_ids[start: start + self.window_size] for start in starts]
+
+  def _score(self, texts):
+    with self.lock:
+      return self._score_windows([self.preprocess(text) for text in texts])
+
+  def _score_windows(self, texts):
+    # Texts longer than the model accepts are split into overlapping windows; the text's
+    # probabilities are the average of its windows' weighted by their token counts
+    input_ids = []
+    owners = []
+    for text_idx, token_ids in enumerate(self.tokenizer(texts, add_special_tokens = False)['input_ids']):
+      for window in self.windows(token_ids):
+        input_ids.append(self.tokenizer.build_inputs_with_special_tokens(window))
+        owners.append(text_idx)
+
+    lengths = [len(window) for window in input_ids]
+    window_probas = np.zeros((len(input_ids), len(self.labels)))
+
+    with self.torch.inference_mode():
+      for batch in token_budget_batches(lengths, self.max_tokens, self.max_batch_size):
+        started = time.perf_counter()
+        inputs = self.tokenizer.pad({'input_ids': [input_ids[idx] for idx in batch]}, return_tensors = 'pt')
+        logits = self.model(**inputs).logits
+        window_probas[batch] = self.torch.softmax(logits, dim = 1)[:, self.label_ids].numpy()
+        self.stats.record(len(batch), sum(lengths[idx] for idx in batch),
+                          len(batch) * max(lengths[idx] for idx in batch), time.perf_counter() - started)
+
+    weights = np.array(lengths, dtype = float)
+    probas = np.zeros((len(texts), len(self.labels)))
+    np.add.at(probas, owners, window_probas * weights[:, None])
+    probas /= np.bincount(owners, weights = weights, minlength = len(texts))[:, None]
+
+    self.stats.texts += len(texts)
+    return probas
+
+  def predict(self, texts):
+    probas = self.score(texts)
+    best = probas.argmax(axis = 1)
+    return [self.labels[label_idx] for label_idx in best], probas[np.arange(len(best)), best]
+
+class PysentimientoScorer(TransformerScorer):
+
+  def __init__(self, analyzer, max_length = 128, model = None, **kwargs):
+    super().__init__(model or analyzer.model, analyzer.tokenizer, labels = PYSENTIMIENTO_LABELS, max_length = max_length, **kwargs)
+    self.lang = getattr(analyzer, 'lang', 'es')
+    self.preprocessing_args = getattr(analyzer, 'preprocessing_args', {})
+
+  def preprocess(self, text):
+    from pysentimiento.preprocessing import preprocess_tweet
+    return preprocess_tweet(str(text), lang = self.lang, **self.preprocessing_args)
+
+class FinbertScorer(TransformerScorer):
+
+  def __init__(self, model, tokenizer, max_length = 512, **kwargs):
+    super().__init__(model, tokenizer, max_length = max_length, **kwargs)
+
+class OnnxModel:
+
+  # Runs a model exported by export_onnx through ONNX Runtime, with the same call signature and
+  # output the scorers use from a transformers model
+  def __init__(self, export_dir, quantized = True, num_threads = None):
+    import onnxruntime
+
+    with open(f'{export_dir}/model.json') as model_file:
+      model_info = json.load(model_file)
+
+    self.config = SimpleNamespace(id2label = model_info['id2label'], _name_or_path = model_info['model_id'],
+                                  _commit_hash = model_info['revision'])
+    self.backend = 'onnx-int8' if quantized else 'onnx'
+
+    options = onnxruntime.SessionOptions()
+    if num_threads:
+      options.intra_op_num_threads = num_threads
+
+    model_path = f'{export_dir}/model-int8.onnx' if quantized else f'{export_dir}/model.onnx'
+    self.session = onnxruntime.InferenceSession(model_path, options, providers = ['CPUExecutionProvider'])
+    self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+  def eval(self):
+    return self
+
+  def __call__(self, **inputs):
+    import torch
+
+    logits, = self.session.run(['logits'], {name: inputs[name].numpy() for name in self.input_names})
+    return SimpleNamespace(logits = torch.from_numpy(logits))
+
+def export_onnx(model, export_dir, quantize = True, opset_version = 13):
+  import torch
+
+  class LogitsOnly(torch.nn.Module):
+
+    def __init__(self):
+      super().__init__()
+      self.model = model
+
+    def forward(self, input_ids, attention_mask):
+      return self.model(input_ids = input_ids, attention_mask = attention_mask).logits
+
+  os.makedirs(export_dir, exist_ok = True)
+  model = model.eval()
+  dummy_input = torch.ones((1, 8), dtype = torch.long)
+  dynamic_axes = {'input_ids': {0: 'batch', 1: 'sequence'}, 'attention_mask': {0: 'batch', 1: 'sequence'}, 'logits': {0: 'batch'}}
+
+  with torch.inference_mode():
+    torch.onnx.export(LogitsOnly(), (dummy_input, dummy_input), f'{export_dir}/model.onnx', input_names = ['input_ids', 'attention_mask'],
+                      output_names = ['logits'], dynamic_axes = dynamic_axes, opset_version = opset_version)
+
+  if quantize:
+    # Dynamic quantization: int8 weights, activations quantized on the fly, no calibration data needed
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(f'{export_dir}/model.onnx', f'{export_dir}/model-int8.onnx', weight_type = QuantType.QInt8)
+
+  config = model.config
+  with open(f'{export_dir}/model.json', 'w') as model_file:
+    json.dump({'model_id': getattr(config, '_name_or_path', ''), 'revision': getattr(config, '_commit_hash', None) or 'main',
+               'id2label': {str(label_id): label for label_id, label in config.id2label.items()}}, model_file)
+
+  return export_dir
+
+def benchmark_scorers(baseline, candidate, texts, warmup = 8):
+  texts = [str(text) for text in texts]
+
+  # Both scorers run the model directly, bypassing the score cache
+  baseline._score(texts[:warmup])
+  candidate._score(texts[:warmup])
+
+  started = time.perf_counter()
+  baseline_scores = baseline._score(texts)
+  baseline_seconds = time.perf_counter() - started
+
+  started = time.perf_counter()
+  candidate_scores = candidate._score(texts)
+  candidate_seconds = time.perf_counter() - started
+
+  return {'texts': len(texts),
+          'baseline_seconds': baseline_seconds,
+          'candidate_seconds': candidate_seconds,
+          'speedup': baseline_seconds / candidate_seconds if candidate_seconds else float('inf'),
+          'label_agreement': float(np.mean(baseline_scores.argmax(axis = 1) == candidate_scores.argmax(axis = 1))) if texts else 1.0,
+          'max_abs_difference': float(np.abs(baseline_scores - candidate_scores).max()) if texts else 0.0}
+
+def _package_version(package_name):
+  from importlib import metadata
+
+  try:
+    return metadata.version(package_name)
+  except metadata.PackageNotFoundError:
+    return 'unknown'
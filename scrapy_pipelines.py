@@ -0,0 +1,63 @@
+from scrapy.exceptions import DropItem
+
+from matcher import TermMatcher
+from near_duplicates import NearDuplicateIndex
+from normalization import NormalizationCache, article_key, normalize_text
+
+# The cleaning of toolbox.clean_news applied to every item while the spider produces it: only the news that
+# mention their search term and are not duplicates reach the feed, so the crawled file does not need to be cleaned again.
+# Enabled by crawler.crawl_partition with: -s ITEM_PIPELINES={"scrapy_pipelines.CleanNewsPipeline": 800}
+class CleanNewsPipeline:
+
+  def __init__(self, normalization_filename = None, near_duplicates_filename = None, partition = None):
+    self.normalization_filename = normalization_filename
+    self.near_duplicates_filename = near_duplicates_filename
+    self.partition = partition
+
+  @classmethod
+  def from_crawler(cls, crawler):
+    return cls(crawler.settings.get('CLEAN_NEWS_NORMALIZATION_CACHE'), crawler.settings.get('CLEAN_NEWS_NEAR_DUPLICATES'),
+               crawler.settings.get('CLEAN_NEWS_PARTITION'))
+
+  def open_spider(self, spider):
+    self.matchers = {}
+    self.seen_keys = set()
+    self.normalization_cache = None if self.normalization_filename is None else NormalizationCache(self.normalization_filename)
+    self.near_duplicates = None if self.near_duplicates_filename is None else NearDuplicateIndex(self.near_duplicates_filename)
+
+  def close_spider(self, spider):
+    if self.normalization_cache is not None:
+      self.normalization_cache.close()
+    if self.near_duplicates is not None:
+      self.near_duplicates.close()
+
+  def process_item(self, item, spider):
+    # Same text the cleaning sees after reading the csv back with astype(str)
+    title, subtitle, text_content, search_term = (str(item.get(field, '')) for field in ['news_title', 'news_subtitle', 'news_text_content', 'search_term'])
+
+    text_content_lowercase = self.normalize(text_content)
+    search_term_lowercase = normalize_text(search_term)
+    if search_term_lowercase not in self.matcher(search_term_lowercase).find_all(text_content_lowercase):
+      raise DropItem(f'La noticia no menciona el término de búsqueda {search_term}: {title}')
+
+    doc_key = article_key(title, subtitle, text_content)
+    if doc_key in self.seen_keys:
+      raise DropItem(f'Noticia duplicada: {title}')
+    self.seen_keys.add(doc_key)
+
+    if self.near_duplicates is not None:
+      text = normalize_text(f'{title} {subtitle}') + ' ' + text_content_lowercase
+      if not self.near_duplicates.keep([doc_key], [text], self.partition)[0]:
+        raise DropItem(f'Noticia casi duplicada: {title}')
+
+    return item
+
+  def normalize(self, text):
+    if self.normalization_cache is None:
+      return normalize_text(text)
+    return self.normalization_cache.normalize_many([text])[text]
+
+  def matcher(self, search_term):
+    if search_term not in self.matchers:
+      self.matchers[search_term] = TermMatcher([search_term])
+    return self.matchers[search_term]
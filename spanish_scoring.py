@@ -0,0 +1,56 @@
+import gc
+import multiprocessing
+import os
+
+import numpy as np
+
+# The model the workers score with. With fork it is the parent's copy, set right before the workers
+# are created; with spawn (Windows) every worker loads its own in _load_analyzer
+_analyzer = None
+
+def _load_analyzer():
+  global _analyzer
+  if _analyzer is None:
+    from sentiment_analysis_spanish import sentiment_analysis
+    _analyzer = sentiment_analysis.SentimentAnalysisSpanish()
+  return _analyzer
+
+def sentiment_spanish_scores(texts, analyzer = None):
+  analyzer = analyzer or _load_analyzer()
+  scores = np.empty(len(texts), dtype = np.float64)
+  for text_idx, text in enumerate(texts):
+    scores[text_idx] = analyzer.sentiment(text)
+  return scores
+
+class SentimentSpanishPool:
+
+  def __init__(self, analyzer = None, max_workers = None, chunksize = 200, min_parallel = 500):
+    global _analyzer
+
+    self.analyzer = analyzer or _load_analyzer()
+    self.max_workers = max_workers or os.cpu_count()
+    self.chunksize = chunksize
+    self.min_parallel = min_parallel
+
+    # All the workers are created here, so create the pool before starting other threads
+    if 'fork' in multiprocessing.get_all_start_methods():
+      # The workers inherit the loaded model copy-on-write. Freezing the objects that already exist
+      # keeps the garbage collector from writing to (and so copying) their memory pages
+      _analyzer = self.analyzer
+      gc.freeze()
+      self.pool = multiprocessing.get_context('fork').Pool(self.max_workers)
+      gc.unfreeze()
+    else:
+      self.pool = multiprocessing.get_context('spawn').Pool(self.max_workers, initializer = _load_analyzer)
+
+  def score(self, texts):
+    texts = list(texts)
+    if len(texts) < self.min_parallel:
+      return sentiment_spanish_scores(texts, self.analyzer)
+
+    chunks = [texts[start: start + self.chunksize] for start in range(0, len(texts), self.chunksize)]
+    return np.concatenate([np.empty(0)] + self.pool.map(sentiment_spanish_scores, chunks))
+
+  def close(self):
+    self.pool.close()
+    self.pool.join()
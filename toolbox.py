@@ -1,17 +1,19 @@
+from dataset import partition_files
 from Impala_Helper import Helper
 from logger import logger
+from matcher import MAX_DISTANCE, TermMatcher
+from normalization import article_key, normalize_text
+from translation import MAX_REQUEST_CHARS, SentenceBatcher, TranslationEngine, TranslationError, create_translator, split_sentences
 
+import json
 import math
 import pandas as pd
 import os
 import shutil
-import unidecode
-from deep_translator import GoogleTranslator
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
 def is_match(search_term, text_content):
   
-  MAX_DISTANCE = 2
-  
   search_term_parts = search_term.split()
   num_search_terms = len(search_term_parts)
 
@@ -38,19 +40,101 @@ def is_match(search_term, text_content):
 
   return False
 
-def clean_news(input_dataframe):
+def match_news(input_dataframe, normalization_cache = None):
 
   input_dataframe = input_dataframe.astype(str)
 
-  input_dataframe['search_term_lowercase'] = input_dataframe['search_term'].apply(lambda search_term: unidecode.unidecode(search_term).lower())
-  input_dataframe['news_text_content_lowercase'] = input_dataframe['news_text_content'].apply(lambda content: unidecode.unidecode(content).lower())
+  input_dataframe['search_term_lowercase'] = input_dataframe['search_term'].apply(normalize_text)
+
+  news_text_content = input_dataframe['news_text_content']
+  if normalization_cache is None:
+    normalized_content = {content: normalize_text(content) for content in news_text_content.unique()}
+  else:
+    normalized_content = normalization_cache.normalize_many(news_text_content.unique())
+  input_dataframe['news_text_content_lowercase'] = news_text_content.map(normalized_content)
+
+  matcher = TermMatcher(input_dataframe['search_term_lowercase'].unique())
+  matched_terms = {content: matcher.find_all(content) for content in input_dataframe['news_text_content_lowercase'].unique()}
+
+  return input_dataframe.loc[[search_term in matched_terms[content] for search_term, content
+                          in zip(input_dataframe['search_term_lowercase'], input_dataframe['news_text_content_lowercase'])]]
+
+def drop_duplicate_news(matched_dataframe, near_duplicates = None, partition = None):
+
+  matched_dataframe = matched_dataframe.drop_duplicates(subset = ['news_title', 'news_subtitle', 'news_text_content'])
+
+  if near_duplicates is not None:
+    doc_keys = [article_key(title, subtitle, content) for title, subtitle, content
+                in zip(matched_dataframe['news_title'], matched_dataframe['news_subtitle'], matched_dataframe['news_text_content'])]
+    texts = (matched_dataframe['news_title'] + ' ' + matched_dataframe['news_subtitle']).apply(normalize_text) + ' ' + matched_dataframe['news_text_content_lowercase']
+    matched_dataframe = matched_dataframe.loc[near_duplicates.keep(doc_keys, texts, partition)]
+
+  return matched_dataframe.drop(columns = ['search_term_lowercase', 'news_text_content_lowercase'])
+
+def clean_news(input_dataframe, normalization_cache = None, near_duplicates = None, partition = None):
+  return drop_duplicate_news(match_news(input_dataframe, normalization_cache), near_duplicates, partition)
+
+def clean_news_file(input_filename, output_filename = None, chunksize = 5000, normalization_cache = None, near_duplicates = None, partition = None):
+
+  output_filename = output_filename or input_filename
+  partial_filename = f'{output_filename}.partial'
+
+  if os.path.exists(partial_filename):
+    os.remove(partial_filename)
+
+  seen_keys = set()
+  header = True
+
+  for chunk in pd.read_csv(input_filename, dtype = str, chunksize = chunksize):
+    matched_news = match_news(chunk, normalization_cache)
+
+    is_first = []
+    for doc_key in map(article_key, matched_news['news_title'], matched_news['news_subtitle'], matched_news['news_text_content']):
+      is_first.append(doc_key not in seen_keys)
+      seen_keys.add(doc_key)
+
+    news_cleaned = drop_duplicate_news(matched_news.loc[is_first], near_duplicates, partition)
+    news_cleaned.to_csv(partial_filename, mode = 'a', header = header, index = False)
+    header = False
 
-  input_dataframe = input_dataframe[input_dataframe.apply(lambda row: is_match(row['search_term_lowercase'], row['news_text_content_lowercase']), axis = 1)]
+  os.replace(partial_filename, output_filename)
 
-  del input_dataframe['search_term_lowercase']
-  del input_dataframe['news_text_content_lowercase']
+def clean_news_parallel(years, dir_name = 'news', max_workers = None, chunksize = 5000, normalization_cache = None, near_duplicates = None):
 
-  return input_dataframe.drop_duplicates(subset = ['news_title', 'news_subtitle', 'news_text_content'])
+  max_workers = max_workers or os.cpu_count() or 1
+  # Years fully submitted whose chunks may still be matching, in order. A year is deduped and written as soon as all
+  # its chunks are matched and every year before it was written, so only the years in flight are held in memory
+  matched_chunks = []
+  pending = set()
+
+  def write_matched_years(block):
+    while matched_chunks and (block or all(future.done() for future in matched_chunks[0][1])):
+      current_year, futures = matched_chunks.pop(0)
+      matched_news = pd.concat([future.result() for future in futures])
+      news_cleaned = drop_duplicate_news(matched_news, near_duplicates, partition = f'news-{current_year}')
+      news_cleaned.to_csv(f'{dir_name}/news-{current_year}.csv', index = False)
+      print(f'NOTICIAS DEL AÑO {current_year} FUERON LIMPIADAS Y FILTRADAS')
+
+  with ProcessPoolExecutor(max_workers = max_workers) as executor:
+    for current_year in years:
+      file_path = f'{dir_name}/news-{current_year}.csv'
+      if not os.path.exists(file_path):
+        print(f'NO HAY NOTICIAS DEL AÑO {current_year} ({file_path} NO EXISTE)')
+        continue
+
+      futures = []
+      for chunk in pd.read_csv(file_path, dtype = str, chunksize = chunksize):
+        if len(pending) >= 2 * max_workers:
+          _, pending = wait(pending, return_when = FIRST_COMPLETED)
+          write_matched_years(block = False)
+        future = executor.submit(match_news, chunk, normalization_cache)
+        futures.append(future)
+        pending.add(future)
+
+      matched_chunks.append((current_year, futures))
+      write_matched_years(block = False)
+
+    write_matched_years(block = True)
 
 def get_date_inputs():
   months = {'enero': '01', 'febrero': '02', 'marzo': '03', 'abril': '04', 'mayo': '05', 'junio': '06', 
@@ -90,76 +174,229 @@ def get_date_inputs():
 
   return months[start_month], start_year, months[end_month], end_year
 
-def save_local(dir_name, result_filename):
+SAVE_LOCAL_FORMATS = ('csv', 'parquet', 'feather')
+
+def save_local(dir_name, result_filename, file_format = 'csv', chunksize = 100000, columns = None):
 
-  file_to_delete = f'{result_filename}.csv'
+  if file_format not in SAVE_LOCAL_FORMATS:
+    raise ValueError(f'Formato inválido: {file_format}. Formatos válidos: {SAVE_LOCAL_FORMATS}')
 
-  if os.path.exists(file_to_delete):
-    os.remove(file_to_delete)
+  result_path = f'{result_filename}.{file_format}'
+
+  if os.path.exists(result_path):
+    os.remove(result_path)
 
   try:
-    all_news = pd.DataFrame()
-    for current_file in os.listdir(dir_name):
-      current_news = pd.read_csv(f'{dir_name}/{current_file}')
-      current_news = current_news.astype(str)
-      all_news = pd.concat([all_news, current_news])
-      
-    all_news.to_csv(f'{result_filename}.csv', index = False)
-    print(f'LAS NOTICIAS FUERON GUARDADAS EXITOSAMENTE COMO {result_filename}.csv')
+    news_files = [f'{dir_name}/{current_file}' for current_file in sorted(os.listdir(dir_name)) if current_file.endswith('.csv')]
+    news_files += partition_files(dir_name)
+
+    # Same columns (and order) pd.concat would produce, taken from the headers only
+    if columns is None:
+      columns = list(dict.fromkeys(column for news_file in news_files for column in _news_columns(news_file)))
+
+    if file_format == 'csv':
+      write_news, close_writer = _csv_writer(result_path, columns)
+    else:
+      write_news, close_writer = _arrow_writer(result_path, file_format, _news_schema(news_files, columns))
+
+    for news_file in news_files:
+      for current_news in _news_chunks(news_file, chunksize, columns):
+        # Only the csv is all text; parquet and feather keep the types of the dataset (e.g. the scores stay floats)
+        if file_format == 'csv':
+          current_news = current_news.astype(str)
+        write_news(current_news.reindex(columns = columns))
+
+    close_writer()
+    print(f'LAS NOTICIAS FUERON GUARDADAS EXITOSAMENTE COMO {result_path}')
   except:
     print('¡ERROR!: INTENTE DESCARGAR Y LIMPIAR LAS NOTICIAS NUEVAMENTE')
 
-Translator = GoogleTranslator(source='es', target='en')
+def _news_columns(news_file):
+
+  if news_file.endswith('.parquet'):
+    import pyarrow.parquet as pq
+    return pq.read_schema(news_file).names
+
+  return pd.read_csv(news_file, nrows = 0).columns
+
+def _news_schema(news_files, columns):
+
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+
+  # The type of a column is the one of the first parquet file that has it; columns only found in csv files are text.
+  # Categorical columns are written as their values: every file has its own categories
+  column_types = {}
+  for news_file in news_files:
+    if news_file.endswith('.parquet'):
+      for field in pq.read_schema(news_file):
+        column_types.setdefault(field.name, field.type.value_type if pa.types.is_dictionary(field.type) else field.type)
+
+  return pa.schema([(column, column_types.get(column, pa.string())) for column in columns])
+
+def _news_chunks(news_file, chunksize, columns):
+
+  # Only the requested columns are read
+  file_columns = [column for column in _news_columns(news_file) if column in columns]
+
+  if news_file.endswith('.parquet'):
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(news_file).iter_batches(batch_size = chunksize, columns = file_columns):
+      yield batch.to_pandas()
+  else:
+    yield from pd.read_csv(news_file, dtype = str, chunksize = chunksize, usecols = file_columns)
+
+def _csv_writer(result_path, columns):
+
+  pd.DataFrame(columns = columns).to_csv(result_path, index = False)
+
+  def write_news(news_dataframe):
+    news_dataframe.to_csv(result_path, mode = 'a', header = False, index = False)
+
+  return write_news, lambda: None
+
+def _arrow_writer(result_path, file_format, schema):
+
+  import pyarrow as pa
+
+  if file_format == 'parquet':
+    import pyarrow.parquet as pq
+    writer = pq.ParquetWriter(result_path, schema)
+  else:
+    # Feather v2 is the Arrow IPC file format
+    writer = pa.ipc.new_file(result_path, schema)
 
-def get_translation(content):
+  def write_news(news_dataframe):
+    writer.write_table(pa.Table.from_pandas(news_dataframe, schema = schema, preserve_index = False))
+
+  return write_news, writer.close
+
+Translator = None
+
+def get_translator():
+  global Translator
+  if Translator is None:
+    Translator = create_translator('google', source = 'es', target = 'en')
+  return Translator
+
+def get_translation(content, translation_cache = None, translator = None):
+  translator = translator or get_translator()
   parts = content.split('.')
+  cached = {} if translation_cache is None else translation_cache.lookup(parts)
+  new_translations = {}
   translated = ''
   for part in parts:
     try:
-      translated_part = Translator.translate(part)
+      if part in cached:
+        translated_part = cached[part]
+      else:
+        translated_part = new_translations[part] = translator.translate(part)
     except:
       translated_part = part
     finally:
       if translated_part:  
         translated += translated_part + '.'
+
+  if translation_cache is not None:
+    translation_cache.store({part: translated_part for part, translated_part in new_translations.items() if translated_part})
         
   return translated[:-1]
 
-def translate_news(news_dataframe, files_location, batch_size = 10):
+TRANSLATED_COLUMNS = {'news_title': 'news_title_english', 'news_subtitle': 'news_subtitle_english', 'news_text_content': 'news_text_content_english'}
+
+def translate_news(news_dataframe, files_location, batch_size = 10, translation_cache = None, translation_engine = None, on_failure = 'raise',
+                   max_chars = MAX_REQUEST_CHARS, resume = False, translator = None):
+
+  if on_failure not in ('raise', 'keep'):
+    raise ValueError(f'on_failure debe ser "raise" o "keep", no {on_failure}')
+
+  if translation_engine is None:
+    translation_engine = TranslationEngine(translator or get_translator())
+
+  sentence_batcher = SentenceBatcher(translation_engine, translation_cache, max_chars)
 
   news_dataframe = news_dataframe.astype(str)
-  translation = pd.DataFrame()
-  num_steps = math.ceil(news_dataframe.shape[0] / batch_size)
+  news_keys = [article_key(title, subtitle, content) for title, subtitle, content
+               in zip(news_dataframe['news_title'], news_dataframe['news_subtitle'], news_dataframe['news_text_content'])]
 
   if os.path.exists(files_location):
-    if os.listdir(files_location):
+    if os.listdir(files_location) and not resume:
       shutil.rmtree(files_location)
       os.mkdir(files_location)
   else:
     os.mkdir(files_location)
 
-  for step in range(num_steps):
+  # The checkpoint maps every part file already written to the article keys of its rows, in order
+  checkpoint = _read_checkpoint(files_location)
+  translated_keys = {news_key for part_keys in checkpoint.values() for news_key in part_keys}
+
+  pending_news = news_dataframe[[news_key not in translated_keys for news_key in news_keys]]
+  pending_keys = [news_key for news_key in news_keys if news_key not in translated_keys]
+
+  if resume and checkpoint:
+    print(f'{files_location}: {news_dataframe.shape[0] - pending_news.shape[0]} NOTICIAS YA TRADUCIDAS, {pending_news.shape[0]} PENDIENTES')
+
+  first_step = max((int(part_file[len('part-'): -len('.csv')]) + 1 for part_file in checkpoint), default = 0)
+  num_steps = math.ceil(pending_news.shape[0] / batch_size)
 
-    english_news_part = news_dataframe.copy().iloc[step * batch_size: (step + 1) * batch_size, :]
+  for step in range(first_step, first_step + num_steps):
 
-    english_news_part['news_title_english'] = english_news_part['news_title'].apply(lambda title: get_translation(title))
-    english_news_part['news_subtitle_english'] = english_news_part['news_subtitle'].apply(lambda subtitle: get_translation(subtitle))
-    english_news_part['news_text_content_english'] = english_news_part['news_text_content'].apply(lambda content: get_translation(content))
+    batch_start = (step - first_step) * batch_size
+    english_news_part = pending_news.copy().iloc[batch_start: batch_start + batch_size, :]
 
-    del english_news_part['news_title']
-    del english_news_part['news_subtitle']
-    del english_news_part['news_text_content']
+    sentences = [sentence for column in TRANSLATED_COLUMNS for content in english_news_part[column] for sentence, _ in split_sentences(content)]
+    translations, failures = sentence_batcher.translate_sentences(sentences)
+
+    if failures:
+      if on_failure == 'raise':
+        raise TranslationError(failures)
+      print(f'¡ADVERTENCIA!: {len(failures)} ORACIONES DEL LOTE {step} NO PUDIERON SER TRADUCIDAS Y SE CONSERVAN EN ESPAÑOL')
+
+    for column, english_column in TRANSLATED_COLUMNS.items():
+      english_news_part[english_column] = english_news_part[column].apply(lambda content: _join_translation(content, translations))
+      del english_news_part[column]
 
     english_news_part.to_csv(f'{files_location}/part-{step}.csv', index = False)
+    checkpoint[f'part-{step}.csv'] = pending_keys[batch_start: batch_start + batch_size]
+    _write_checkpoint(files_location, checkpoint)
 
     print(f'{files_location}-{step}')
 
-  for step in range(num_steps):
-    to_append = pd.read_csv(f'{files_location}/part-{step}.csv')
-    to_append = to_append.astype(str)
-    translation = pd.concat([translation, to_append])
+  if not news_keys:
+    return pd.DataFrame()
+
+  translated_parts = []
+  for part_file, part_keys in checkpoint.items():
+    translated_part = pd.read_csv(f'{files_location}/{part_file}').astype(str)
+    translated_part.index = part_keys
+    translated_parts.append(translated_part)
+
+  translation = pd.concat(translated_parts)
+  translation = translation[~translation.index.duplicated()]
+
+  return translation.loc[news_keys].reset_index(drop = True)
+
+def _read_checkpoint(files_location):
+  checkpoint_filename = f'{files_location}/checkpoint.json'
+
+  if not os.path.exists(checkpoint_filename):
+    return {}
+
+  with open(checkpoint_filename) as checkpoint_file:
+    checkpoint = json.load(checkpoint_file)
+
+  return {part_file: part_keys for part_file, part_keys in checkpoint.items() if os.path.exists(f'{files_location}/{part_file}')}
+
+def _write_checkpoint(files_location, checkpoint):
+  checkpoint_filename = f'{files_location}/checkpoint.json'
+
+  with open(f'{checkpoint_filename}.partial', 'w') as checkpoint_file:
+    json.dump(checkpoint, checkpoint_file)
+
+  os.replace(f'{checkpoint_filename}.partial', checkpoint_filename)
 
-  return translation
+def _join_translation(content, translations):
+  return ''.join(translations.get(sentence, sentence) + separator for sentence, separator in split_sentences(content))
 
 def upload_to_lz(dataframe, database, table_name):
   dataframe = dataframe.astype(str)
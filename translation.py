@@ -0,0 +1,321 @@
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cache_store import SqliteCache
+from normalization import content_hash
+
+class TranslationCache(SqliteCache):
+
+  def __init__(self, filename = 'translation-cache.sqlite', source = 'es', target = 'en', memory_items = 10000, max_bytes = 1 << 30):
+    super().__init__(filename, table = 'translations', memory_items = memory_items, max_bytes = max_bytes)
+    self.source = source
+    self.target = target
+
+  def sentence_key(self, sentence):
+    return content_hash(f'{self.source}>{self.target}\x1f{" ".join(sentence.split())}')
+
+  def lookup(self, sentences):
+    keys = {sentence: self.sentence_key(sentence) for sentence in dict.fromkeys(sentences)}
+    stored = self.get_many(keys.values())
+    return {sentence: stored[key] for sentence, key in keys.items() if key in stored}
+
+  def store(self, translations):
+    self.put_many((self.sentence_key(sentence), translation) for sentence, translation in translations.items())
+
+class TranslatorBackend:
+
+  local = False
+  max_chars = None
+  # Only a backend whose translate can run from several threads at once is called concurrently
+  thread_safe = False
+
+  def translate(self, text):
+    raise NotImplementedError
+
+  def translate_batch(self, texts):
+    return [self.translate(text) for text in texts]
+
+class GoogleBackend(TranslatorBackend):
+
+  thread_safe = True
+
+  def __init__(self, source = 'es', target = 'en'):
+    self.source = source
+    self.target = target
+    # GoogleTranslator keeps the text of the request in the instance, so every thread needs its own
+    self.local_translators = threading.local()
+    self._translator()
+
+  def translate(self, text):
+    return self._translator().translate(text)
+
+  def _translator(self):
+    if not hasattr(self.local_translators, 'translator'):
+      from deep_translator import GoogleTranslator
+      self.local_translators.translator = GoogleTranslator(source = self.source, target = self.target)
+    return self.local_translators.translator
+
+class MarianBackend(TranslatorBackend):
+
+  local = True
+  max_chars = 1000
+
+  def __init__(self, model_name = 'Helsinki-NLP/opus-mt-es-en', batch_size = 16, num_threads = None, num_beams = 4, max_length = 512):
+    import torch
+    from transformers import MarianMTModel, MarianTokenizer
+
+    if num_threads:
+      torch.set_num_threads(num_threads)
+
+    self.torch = torch
+    self.tokenizer = MarianTokenizer.from_pretrained(model_name)
+    self.model = MarianMTModel.from_pretrained(model_name).eval()
+    self.batch_size = batch_size
+    self.num_beams = num_beams
+    self.max_length = max_length
+
+  def translate(self, text):
+    return self.translate_batch([text])[0]
+
+  def translate_batch(self, texts):
+    # Sorting by length keeps the texts of a batch similar in size, so little compute goes to padding
+    order = sorted(range(len(texts)), key = lambda idx: len(texts[idx]))
+    translations = [None] * len(texts)
+
+    with self.torch.inference_mode():
+      for start in range(0, len(order), self.batch_size):
+        batch = order[start: start + self.batch_size]
+        inputs = self.tokenizer([texts[idx] for idx in batch], return_tensors = 'pt', padding = True, truncation = True, max_length = self.max_length)
+        outputs = self.model.generate(**inputs, num_beams = self.num_beams, max_length = self.max_length)
+        for idx, translation in zip(batch, self.tokenizer.batch_decode(outputs, skip_special_tokens = True)):
+          translations[idx] = translation
+
+    return translations
+
+TRANSLATOR_BACKENDS = {'google': GoogleBackend, 'marian': MarianBackend}
+
+def create_translator(backend = 'google', **kwargs):
+  if backend not in TRANSLATOR_BACKENDS:
+    raise ValueError(f'Traductor inválido: {backend}. Traductores válidos: {list(TRANSLATOR_BACKENDS)}')
+  return TRANSLATOR_BACKENDS[backend](**kwargs)
+
+class TranslationError(Exception):
+
+  def __init__(self, failures):
+    self.failures = failures
+    super().__init__(f'{len(failures)} textos no pudieron ser traducidos. Primer error: {next(iter(failures.values()), None)!r}')
+
+class RateLimiter:
+
+  def __init__(self, requests_per_second):
+    self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+    self.next_request = 0.0
+    self.lock = threading.Lock()
+
+  def acquire(self):
+    with self.lock:
+      now = time.monotonic()
+      wait_time = max(0.0, self.next_request - now)
+      self.next_request = max(now, self.next_request) + self.interval
+    if wait_time:
+      time.sleep(wait_time)
+
+class TranslationEngine:
+
+  def __init__(self, translator, max_workers = 8, requests_per_second = 5.0, max_retries = 4, backoff = 1.0, max_backoff = 30.0,
+               translation_cache = None):
+    self.translator = translator
+    self.max_workers = max_workers
+    self.rate_limiter = RateLimiter(requests_per_second)
+    self.max_retries = max_retries
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.translation_cache = translation_cache
+
+  def translate_many(self, texts):
+    pending = [text for text in dict.fromkeys(texts) if text.strip()]
+    translations = {text: '' for text in texts if not text.strip()}
+    failures = {}
+
+    if self.translation_cache is not None:
+      translations.update(self.translation_cache.lookup(pending))
+      pending = [text for text in pending if text not in translations]
+
+    new_translations = {}
+    if getattr(self.translator, 'local', False):
+      # A local model has no rate limit or network round trip: it is fed whole batches instead
+      try:
+        new_translations = dict(zip(pending, self.translator.translate_batch(pending)))
+      except Exception as error:
+        failures = {text: error for text in pending}
+    else:
+      max_workers = self.max_workers if getattr(self.translator, 'thread_safe', False) else 1
+      with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = {executor.submit(self.translate, text): text for text in pending}
+        for future in as_completed(futures):
+          text = futures[future]
+          try:
+            new_translations[text] = future.result()
+          except Exception as error:
+            failures[text] = error
+
+    if self.translation_cache is not None:
+      self.translation_cache.store({text: translation for text, translation in new_translations.items() if translation})
+
+    translations.update(new_translations)
+    return translations, failures
+
+  def translate(self, text):
+    for attempt in range(self.max_retries + 1):
+      self.rate_limiter.acquire()
+      try:
+        return self.translator.translate(text)
+      except Exception:
+        if attempt == self.max_retries:
+          raise
+        time.sleep(min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+class StubTranslator(TranslatorBackend):
+
+  thread_safe = True
+
+  def __init__(self, latency = 0.0, error_rate = 0.0, seed = None):
+    self.latency = latency
+    self.error_rate = error_rate
+    self.random = random.Random(seed)
+    self.lock = threading.Lock()
+    self.calls = 0
+
+  def translate(self, text):
+    with self.lock:
+      self.calls += 1
+      fails = self.random.random() < self.error_rate
+    time.sleep(self.latency)
+    if fails:
+      raise ConnectionError(f'Error simulado traduciendo: {text[:30]}')
+    return '\n'.join(f'[en] {line}' for line in text.split('\n'))
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?…])\s+(?=[¿¡"“«\'(\[]?[A-ZÁÉÍÓÚÑÜ0-9])')
+ABBREVIATIONS = {'sr', 'sra', 'srta', 'dr', 'dra', 'ud', 'uds', 'etc', 'pag', 'pág', 'num', 'núm', 'no', 'art', 'av', 'cra', 'cl',
+                 'ltda', 'cia', 'cía', 'vs', 'aprox', 'dpto', 'gral', 'lic', 'ing', 'prof', 'min', 'máx', 'mín', 'tel', 'pbro'}
+MAX_REQUEST_CHARS = 4500
+
+def split_sentences(text):
+  sentences = []
+  start = 0
+
+  for boundary in SENTENCE_BOUNDARY.finditer(text):
+    sentence = text[start: boundary.start()]
+    last_word = sentence.rsplit(None, 1)[-1] if sentence.strip() else ''
+    if last_word.endswith('.') and _is_abbreviation(last_word):
+      continue
+    sentences.append((sentence, boundary.group()))
+    start = boundary.end()
+
+  sentences.append((text[start:], ''))
+  return sentences
+
+def needs_translation(sentence):
+  return any(char.isalpha() for char in sentence)
+
+def _is_abbreviation(word):
+  word = word.lower().lstrip('(¿¡"“«\'').rstrip('.')
+  # Dotted words with letters (S.A., EE.UU.) are abbreviations; dotted numbers ($4.500, 2.5%) are not
+  dotted = '.' in word and any(char.isalpha() for char in word) and not any(char.isdigit() for char in word)
+  return word in ABBREVIATIONS or (len(word) == 1 and word.isalpha()) or dotted
+
+class SentenceBatcher:
+
+  def __init__(self, translation_engine, translation_cache = None, max_chars = MAX_REQUEST_CHARS, separator = '\n'):
+    self.translation_engine = translation_engine
+    self.translation_cache = translation_cache
+    self.max_chars = min(max_chars, getattr(translation_engine.translator, 'max_chars', None) or max_chars)
+    self.separator = separator
+
+  def translate_sentences(self, sentences):
+    translations = {}
+    pending = []
+
+    for sentence in dict.fromkeys(sentences):
+      if needs_translation(sentence):
+        pending.append(sentence)
+      else:
+        translations[sentence] = sentence
+
+    if self.translation_cache is not None:
+      translations.update(self.translation_cache.lookup(pending))
+      pending = [sentence for sentence in pending if sentence not in translations]
+
+    pieces = {sentence: self._pieces(sentence) for sentence in pending}
+    piece_translations, failed_pieces = self._translate_pieces([piece for sentence_pieces in pieces.values() for piece in sentence_pieces])
+
+    new_translations = {}
+    failures = {}
+    for sentence, sentence_pieces in pieces.items():
+      failed = [failed_pieces[piece] for piece in sentence_pieces if piece in failed_pieces]
+      if failed:
+        failures[sentence] = failed[0]
+      else:
+        new_translations[sentence] = ' '.join(piece_translations[piece] for piece in sentence_pieces)
+
+    if self.translation_cache is not None:
+      self.translation_cache.store({sentence: translation for sentence, translation in new_translations.items() if translation})
+
+    translations.update(new_translations)
+    return translations, failures
+
+  def _pieces(self, sentence):
+    # Requests can not contain the separator, and a sentence longer than a request is cut between words
+    pieces = []
+    piece = ''
+    for word in sentence.split():
+      if piece and len(piece) + 1 + len(word) > self.max_chars:
+        pieces.append(piece)
+        piece = word
+      else:
+        piece = f'{piece} {word}' if piece else word
+    pieces.append(piece)
+    return pieces
+
+  def _translate_pieces(self, pieces):
+    if getattr(self.translation_engine.translator, 'local', False):
+      return self.translation_engine.translate_many(pieces)
+
+    requests = {}
+    request = []
+    request_chars = 0
+
+    for piece in dict.fromkeys(pieces):
+      if request and request_chars + len(self.separator) + len(piece) > self.max_chars:
+        requests[self.separator.join(request)] = request
+        request = []
+        request_chars = 0
+      request_chars += len(piece) + (len(self.separator) if request else 0)
+      request.append(piece)
+
+    if request:
+      requests[self.separator.join(request)] = request
+
+    responses, failures = self.translation_engine.translate_many(requests)
+
+    translations = {}
+    unpacked = []
+    for request_text, request_pieces in requests.items():
+      response = responses.get(request_text)
+      response_pieces = response.split(self.separator) if response is not None else []
+      if len(response_pieces) == len(request_pieces):
+        translations.update(zip(request_pieces, (response_piece.strip() for response_piece in response_pieces)))
+      else:
+        unpacked.extend(request_pieces)
+
+    # A failed request, or one whose response lost the alignment, is sent again one piece at a time
+    failed_pieces = {}
+    if unpacked:
+      responses, failures = self.translation_engine.translate_many(unpacked)
+      translations.update((piece, responses[piece]) for piece in unpacked if piece in responses)
+      failed_pieces = {piece: failures[piece] for piece in unpacked if piece in failures}
+
+    return translations, failed_pieces